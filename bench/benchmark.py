@@ -0,0 +1,515 @@
+#!/usr/bin/env python
+
+# Cloudeebus
+#
+# Copyright 2012 Intel Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# Benchmark suite running against a private dbus-daemon and a test service,
+# first driving CloudeebusService directly, then end to end through
+# cloudeebus.py with local WebSocket clients. Measures:
+#  - dbusSend latency percentiles and throughput
+#  - signal throughput, and fan-out to N subscribers end to end
+#  - agent round trips through serviceAddAgent / srvCB / returnMethod
+#  - large payload replies, by protocol
+# Results are written as JSON, to compare versions:
+#  {version, python, date, options,
+#   direct: {dbusSend, signals, agent, payloads: {protocol: {size: ...}}},
+#   endToEnd: {dbusSend, signals, payloads}}
+#
+# usage: python bench/benchmark.py [-n CALLS] [-m SIGNALS] [-N SUBSCRIBERS]
+#                                  [-p PORT] [--direct-only] [-o OUTPUT]
+
+import argparse, json, os, socket, subprocess, sys, time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ENGINE_DIR = os.path.join(BENCH_DIR, "..", "cloudeebus")
+
+SERVICE_NAME = "org.cloudeebus.Benchmark"
+OBJECT_PATH = "/org/cloudeebus/Benchmark"
+INTERFACE = "org.cloudeebus.Benchmark"
+
+AGENT_PATH = "/org/cloudeebus/BenchmarkAgent"
+AGENT_INTERFACE = "org.cloudeebus.BenchmarkAgent"
+AGENT_XML = ('<node><interface name="' + AGENT_INTERFACE + '">'
+             '<method name="Ping"><arg type="s" name="value"/>'
+             '<arg type="s" name="result" direction="out"/></method>'
+             '</interface></node>')
+
+PAYLOAD_SIZES = [1024, 65536, 1048576]
+
+
+
+###############################################################################
+# Test service, run in its own process
+
+def runService():
+    import dbus, dbus.service, gobject
+    from dbus.mainloop.glib import DBusGMainLoop
+    DBusGMainLoop(set_as_default=True)
+
+    class BenchmarkService(dbus.service.Object):
+        @dbus.service.method(INTERFACE, in_signature="s", out_signature="s")
+        def Echo(self, value):
+            return value
+
+        @dbus.service.method(INTERFACE, in_signature="u", out_signature="ay")
+        def Bytes(self, size):
+            return dbus.ByteArray(os.urandom(size))
+
+        @dbus.service.method(INTERFACE, in_signature="uu", out_signature="")
+        def EmitTicks(self, count, size):
+            payload = dbus.ByteArray(os.urandom(size))
+            for index in range(count):
+                self.Tick(index, payload)
+
+        @dbus.service.signal(INTERFACE, signature="uay")
+        def Tick(self, index, payload):
+            pass
+
+    bus = dbus.SessionBus()
+    name = dbus.service.BusName(SERVICE_NAME, bus)
+    BenchmarkService(bus, OBJECT_PATH)
+    gobject.MainLoop().run()
+
+
+
+###############################################################################
+# Private bus and processes
+
+def missingModules(directOnly):
+    '''
+    modules needed by the suite, checked before starting any process
+    '''
+    modules = ["dbus", "dbus.mainloop.glib", "gobject", "twisted.internet.glib2reactor"]
+    if not directOnly:
+        modules.append("autobahn.wamp")
+    missing = []
+    for name in modules:
+        try:
+            __import__(name)
+        except ImportError:
+            missing.append(name)
+    return missing
+
+
+def startBus():
+    '''
+    start a private session bus, used by this process and its children
+    '''
+    daemon = subprocess.Popen(["dbus-daemon", "--session", "--nofork", "--print-address"],
+                              stdout=subprocess.PIPE)
+    os.environ["DBUS_SESSION_BUS_ADDRESS"] = daemon.stdout.readline().strip()
+    return daemon
+
+
+def waitForName(name, timeout=10):
+    import dbus
+    # private connection, the shared one is created later with the main loop
+    bus = dbus.SessionBus(private=True)
+    deadline = time.time() + timeout
+    while not bus.name_has_owner(name):
+        if time.time() > deadline:
+            raise Exception("Error: %s did not start" % name)
+        time.sleep(0.05)
+    bus.close()
+
+
+def waitForPort(port, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(("localhost", port)).close()
+            return
+        except socket.error:
+            if time.time() > deadline:
+                raise Exception("Error: cloudeebus.py did not start on port %d" % port)
+            time.sleep(0.05)
+
+
+def stopProcess(process):
+    if process.poll() is None:
+        process.terminate()
+        process.wait()
+
+
+
+###############################################################################
+# Measurement helpers
+
+def percentiles(samples):
+    '''
+    latency summary in ms
+    '''
+    samples = sorted(samples)
+    def pick(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000
+    return {
+        'count': len(samples),
+        'mean': sum(samples) / len(samples) * 1000,
+        'p50': pick(0.5),
+        'p90': pick(0.9),
+        'p99': pick(0.99),
+        'max': samples[-1] * 1000
+    }
+
+
+def dbusCallDeferred(method, *args, **keywords):
+    from twisted.internet import defer
+    request = defer.Deferred()
+    method(*args, reply_handler=lambda *result: request.callback(result),
+           error_handler=request.errback, **keywords)
+    return request
+
+
+def sendArgs(method, args, signature=None):
+    arglist = ["session", SERVICE_NAME, OBJECT_PATH, INTERFACE, method, json.dumps(args)]
+    if signature is not None:
+        arglist.append(signature)
+    return arglist
+
+
+class Collector:
+    '''
+    engine factory calling the listener of each topic with its events
+    '''
+    def __init__(self):
+        self.listeners = {}
+
+    def dispatch(self, topic, event):
+        listener = self.listeners.get(topic)
+        if listener is not None:
+            listener(event)
+
+
+class Counter:
+    '''
+    deferred fired once count events are received
+    '''
+    def __init__(self, count):
+        from twisted.internet import defer
+        self.remaining = count
+        self.done = defer.Deferred()
+
+    def event(self, *args):
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.done.callback(None)
+
+
+
+###############################################################################
+# Benchmarks, call(method, arglist) returns a deferred RPC result
+
+def benchSend(call, calls):
+    '''
+    sequential latency, then throughput of concurrent calls
+    '''
+    from twisted.internet import defer
+    @defer.inlineCallbacks
+    def run():
+        arglist = sendArgs("Echo", ["hello"], "s")
+        latencies = []
+        for i in range(calls):
+            start = time.time()
+            yield call("dbusSend", arglist)
+            latencies.append(time.time() - start)
+        start = time.time()
+        yield defer.DeferredList([call("dbusSend", arglist) for i in range(calls)], fireOnOneErrback=True)
+        result = percentiles(latencies)
+        result['throughput'] = calls / (time.time() - start)
+        defer.returnValue(result)
+    return run()
+
+
+def benchSignals(call, counters, signals, size):
+    '''
+    time for every subscriber to receive the signals, once EmitTicks returns
+    '''
+    from twisted.internet import defer
+    @defer.inlineCallbacks
+    def run():
+        start = time.time()
+        yield call("dbusSend", sendArgs("EmitTicks", [signals, size], "uu"))
+        yield defer.DeferredList([counter.done for counter in counters], fireOnOneErrback=True)
+        elapsed = time.time() - start
+        defer.returnValue({
+            'subscribers': len(counters),
+            'signals': signals,
+            'size': size,
+            'seconds': elapsed,
+            'deliveries': signals * len(counters) / elapsed
+        })
+    return run()
+
+
+def benchAgent(serviceName, calls):
+    '''
+    dbus round trips to an agent method answered through returnMethod
+    '''
+    import dbus
+    from twisted.internet import defer
+    proxy = dbus.SessionBus().get_object(serviceName, AGENT_PATH)
+    @defer.inlineCallbacks
+    def run():
+        latencies = []
+        for i in range(calls):
+            start = time.time()
+            yield dbusCallDeferred(proxy.Ping, "ping", dbus_interface=AGENT_INTERFACE)
+            latencies.append(time.time() - start)
+        defer.returnValue(percentiles(latencies))
+    return run()
+
+
+def benchPayloads(call, calls):
+    '''
+    latency of "ay" replies by size
+    '''
+    from twisted.internet import defer
+    @defer.inlineCallbacks
+    def run():
+        results = {}
+        for size in PAYLOAD_SIZES:
+            latencies = []
+            for i in range(calls):
+                start = time.time()
+                yield call("dbusSend", sendArgs("Bytes", [size], "u"))
+                latencies.append(time.time() - start)
+            results[str(size)] = percentiles(latencies)
+        defer.returnValue(results)
+    return run()
+
+
+
+###############################################################################
+# Engine driven directly
+
+def runDirect(args):
+    from twisted.internet import defer
+    import cloudeebusengine
+    collector = Collector()
+    cloudeebusengine.factory = collector
+    cloudeebusengine.OPENDOOR = True
+    permissions = {'permissions': [], 'authextra': '', 'services': []}
+
+    def newSession(protocol="json"):
+        session = cloudeebusengine.CloudeebusService(permissions)
+        session.getVersion([cloudeebusengine.VERSION, [protocol]])
+        return session
+
+    def caller(session):
+        return lambda method, arglist: defer.maybeDeferred(getattr(session, method), arglist)
+
+    @defer.inlineCallbacks
+    def run():
+        results = {}
+        session = newSession()
+        call = caller(session)
+        results['dbusSend'] = yield benchSend(call, args.calls)
+
+        # sessions share one signal handler, dispatching once per signal
+        sessions = [newSession() for i in range(args.subscribers)]
+        topics = set([subscriber.dbusRegister(["session", SERVICE_NAME, OBJECT_PATH, INTERFACE, "Tick"])
+                      for subscriber in sessions])
+        counter = Counter(args.signals)
+        collector.listeners[topics.pop()] = counter.event
+        results['signals'] = yield benchSignals(call, [counter], args.signals, 64)
+        for subscriber in sessions:
+            subscriber.close()
+
+        # agent answering its calls as cloudeebus.js does
+        agentName = SERVICE_NAME + ".DirectAgent"
+        agent = newSession()
+        agent.serviceAdd(["session", agentName])
+        agent.serviceAddAgent([agentName, AGENT_PATH, AGENT_XML])
+        methodId = "#".join([agentName, AGENT_PATH, AGENT_INTERFACE, "Ping"])
+        def answer(event):
+            pendingCall = json.loads(event)
+            agent.returnMethod([methodId, pendingCall['callIndex'], True, json.dumps([pendingCall['args'][0]])])
+        collector.listeners[methodId] = answer
+        results['agent'] = yield benchAgent(agentName, args.calls)
+        agent.close()
+
+        results['payloads'] = {}
+        for protocol in cloudeebusengine.PROTOCOLS:
+            results['payloads'][protocol] = yield benchPayloads(caller(newSession(protocol)), args.payload_calls)
+        session.close()
+        defer.returnValue(results)
+    return run()
+
+
+
+###############################################################################
+# End to end through cloudeebus.py
+
+def runEndToEnd(args):
+    from twisted.internet import defer
+    from autobahn.websocket import connectWS
+    from autobahn.wamp import WampClientFactory, WampCraClientProtocol
+
+    class BenchmarkClientProtocol(WampCraClientProtocol):
+        def onSessionOpen(self):
+            # anonymous authentication, the server runs in opendoor mode
+            request = self.authenticate()
+            request.addCallbacks(lambda permissions: self.factory.ready.callback(self),
+                                 self.factory.ready.errback)
+
+    def connectClient():
+        factory = WampClientFactory("ws://localhost:%d" % args.port)
+        factory.protocol = BenchmarkClientProtocol
+        factory.ready = defer.Deferred()
+        connectWS(factory)
+        return factory.ready
+
+    server = subprocess.Popen([sys.executable, os.path.join(ENGINE_DIR, "cloudeebus.py"),
+                               "--opendoor", "--port", str(args.port)])
+
+    @defer.inlineCallbacks
+    def run():
+        try:
+            waitForPort(args.port)
+            results = {}
+            client = yield connectClient()
+            yield client.call("getVersion")
+            results['dbusSend'] = yield benchSend(client.call, args.calls)
+
+            # one WebSocket client per subscriber
+            subscribers = yield defer.gatherResults([connectClient() for i in range(args.subscribers)])
+            counters = []
+            for subscriber in subscribers:
+                topic = yield subscriber.call("dbusRegister", ["session", SERVICE_NAME, OBJECT_PATH, INTERFACE, "Tick"])
+                counter = Counter(args.signals)
+                subscriber.subscribe(topic, counter.event)
+                counters.append(counter)
+                # the subscription is handled by the server before this reply
+                yield subscriber.call("getVersion")
+            results['signals'] = yield benchSignals(client.call, counters, args.signals, 64)
+            for subscriber in subscribers:
+                subscriber.sendClose()
+
+            agentName = SERVICE_NAME + ".Agent"
+            agent = yield connectClient()
+            yield agent.call("serviceAdd", ["session", agentName])
+            yield agent.call("serviceAddAgent", [agentName, AGENT_PATH, AGENT_XML])
+            methodId = "#".join([agentName, AGENT_PATH, AGENT_INTERFACE, "Ping"])
+            def answer(topic, event):
+                pendingCall = json.loads(event)
+                agent.call("returnMethod", [methodId, pendingCall['callIndex'], True, json.dumps([pendingCall['args'][0]])])
+            agent.subscribe(methodId, answer)
+            yield agent.call("getVersion")
+            results['agent'] = yield benchAgent(agentName, args.calls)
+            agent.sendClose()
+
+            results['payloads'] = {'json': (yield benchPayloads(client.call, args.payload_calls))}
+            client.sendClose()
+            defer.returnValue(results)
+        finally:
+            stopProcess(server)
+    return run()
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cloudeebus benchmark suite.')
+    parser.add_argument('-n', '--calls', type=int, default=1000,
+        help='number of calls for latency and throughput')
+    parser.add_argument('-m', '--signals', type=int, default=1000,
+        help='number of signals emitted')
+    parser.add_argument('-N', '--subscribers', type=int, default=10,
+        help='number of signal subscribers')
+    parser.add_argument('--payload-calls', type=int, default=20,
+        help='number of calls per payload size')
+    parser.add_argument('-p', '--port', type=int, default=9099,
+        help='port number of the cloudeebus.py server')
+    parser.add_argument('--direct-only', action='store_true',
+        help='do not run the end to end benchmarks')
+    parser.add_argument('-o', '--output',
+        help='path to the JSON results, standard output by default')
+    parser.add_argument('--service', action='store_true',
+        help=argparse.SUPPRESS)
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.service:
+        runService()
+        sys.exit(0)
+
+    missing = missingModules(args.direct_only)
+    if missing:
+        sys.exit("Error: missing python modules: " + ", ".join(missing))
+
+    daemon = startBus()
+    service = None
+    try:
+        service = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--service"])
+        waitForName(SERVICE_NAME)
+
+        from twisted.internet import glib2reactor
+        glib2reactor.install()
+        from twisted.internet import reactor, defer
+        from twisted.python.failure import Failure
+        from dbus.mainloop.glib import DBusGMainLoop
+        DBusGMainLoop(set_as_default=True)
+        # as in cloudeebus.py, large payloads are encoded in the reactor
+        # thread pool, which needs the glib main loop to release the GIL
+        import gobject
+        gobject.threads_init()
+        from dbus import glib
+        glib.init_threads()
+
+        sys.path.insert(0, ENGINE_DIR)
+        import cloudeebusengine
+
+        results = {
+            'version': cloudeebusengine.VERSION,
+            'python': sys.version.split()[0],
+            'date': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'options': {
+                'calls': args.calls,
+                'signals': args.signals,
+                'subscribers': args.subscribers,
+                'payloadCalls': args.payload_calls
+            }
+        }
+        failures = []
+
+        @defer.inlineCallbacks
+        def main():
+            try:
+                results['direct'] = yield runDirect(args)
+                if not args.direct_only:
+                    results['endToEnd'] = yield runEndToEnd(args)
+            except Exception:
+                failures.append(Failure())
+            finally:
+                reactor.stop()
+
+        reactor.callWhenRunning(main)
+        reactor.run()
+        if failures:
+            failures[0].raiseException()
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if args.output:
+            outfile = open(args.output, "w")
+            outfile.write(output + "\n")
+            outfile.close()
+        else:
+            print(output)
+    finally:
+        if service is not None:
+            stopProcess(service)
+        stopProcess(daemon)
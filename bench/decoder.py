@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# Cloudeebus
+#
+# Copyright 2012 Intel Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# Micro-benchmark of JSON args decoding: generic decoding of "dbus.Type(value)"
+# tagged strings versus decoding compiled from the method signature.
+#
+# usage: python bench/decoder.py [-n REPEAT] [-s SIZE]
+
+import argparse, json, os, sys, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cloudeebus"))
+import cloudeebusengine
+
+
+def payloads(size):
+    '''
+    JSON args lists as sent by cloudeebus.js, with their method signature
+    '''
+    return [
+        ("ay", [range(256) * (size / 256)]),
+        ("ai", [range(size)]),
+        ("ad", [[i * 0.5 for i in range(size)]]),
+        ("as", [["string %d" % i for i in range(size)]]),
+        ("a{sv}", [dict(("key %d" % i, i) for i in range(size / 10))]),
+        ("a(isd)", [[[i, "name %d" % i, i * 0.5] for i in range(size / 10)]]),
+        ("sai", ["tagged", ["dbus.Int32(%d)" % i for i in range(size / 10)]])
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cloudeebus args decoder benchmark.')
+    parser.add_argument('-n', '--repeat', type=int, default=20,
+        help='number of decodings per payload')
+    parser.add_argument('-s', '--size', type=int, default=100000,
+        help='number of array elements per payload')
+    args = parser.parse_args(sys.argv[1:])
+
+    print("%-8s %12s %12s %8s" % ("sig", "generic ms", "compiled ms", "speedup"))
+    for (signature, payload) in payloads(args.size):
+        # decode what the engine receives, i.e. the parsed JSON string
+        jsonArgs = json.loads(json.dumps(payload))
+        decoder = cloudeebusengine.argsDecoder(signature)
+        generic = min(timeit.repeat(lambda: cloudeebusengine.decodeArgs(jsonArgs),
+            number=1, repeat=args.repeat)) * 1000
+        compiled = min(timeit.repeat(lambda: decoder(jsonArgs),
+            number=1, repeat=args.repeat)) * 1000
+        print("%-8s %12.2f %12.2f %7.1fx" % (signature, generic, compiled, generic / compiled))
@@ -16,24 +16,17 @@
 
 
 
-/*****************************************************************************/
-
-var dbus = { // hook object for dbus types not translated by python-json
-		Double: function(value, level) {
-			return value;
-		}
-};
-
-
-
 /*****************************************************************************/
 
 var cloudeebus = window.cloudeebus = {
-		version: "0.6.1",
-		minVersion: "0.6.0"
+		version: "0.7.0",
+		minVersion: "0.7.0",
+		protocols: ["native", "json"], // by preference
+		protocol: "json"
 };
 
 cloudeebus.reset = function() {
+	cloudeebus.protocol = "json";
 	cloudeebus.sessionBus = null;
 	cloudeebus.systemBus = null;
 	cloudeebus.wampSession = null;
@@ -60,6 +53,84 @@ cloudeebus.getError = function(error) {
 	return error; // Autobahn error
 };
 
+cloudeebus.BYTE_ARRAY_KEY = "dbus.ByteArray";
+
+
+cloudeebus.parseJSON = function(str) {
+	// byte arrays are encoded as {"dbus.ByteArray": base64 string}
+	var value = JSON.parse(str);
+	if (str.indexOf('"' + cloudeebus.BYTE_ARRAY_KEY + '"') != -1)
+		value = cloudeebus._decodeByteArrays(value);
+	return value;
+};
+
+
+cloudeebus._decodeByteArrays = function(value) {
+	if (value == null || typeof value != "object")
+		return value;
+	var base64 = value[cloudeebus.BYTE_ARRAY_KEY];
+	if (typeof base64 == "string") {
+		var str = atob(base64);
+		var bytes = new Uint8Array(str.length);
+		for (var i=0; i < str.length; i++)
+			bytes[i] = str.charCodeAt(i);
+		return bytes;
+	}
+	for (var key in value)
+		value[key] = cloudeebus._decodeByteArrays(value[key]);
+	return value;
+};
+
+
+cloudeebus.stringifyJSON = function(value) {
+	// Uint8Array values are encoded as {"dbus.ByteArray": base64 string}
+	return JSON.stringify(value, function(key, val) {
+		if (val instanceof Uint8Array)
+			return cloudeebus._encodeByteArray(val);
+		return val;
+	});
+};
+
+
+cloudeebus._encodeByteArray = function(bytes) {
+	var str = "";
+	var chunk = 0x8000;
+	for (var i=0; i < bytes.length; i += chunk)
+		str += String.fromCharCode.apply(null, bytes.subarray(i, i + chunk));
+	var encoded = {};
+	encoded[cloudeebus.BYTE_ARRAY_KEY] = btoa(str);
+	return encoded;
+};
+
+
+cloudeebus._encodeByteArrays = function(value) {
+	if (value == null || typeof value != "object")
+		return value;
+	if (value instanceof Uint8Array)
+		return cloudeebus._encodeByteArray(value);
+	var encoded = (value instanceof Array) ? [] : {};
+	for (var key in value)
+		encoded[key] = cloudeebus._encodeByteArrays(value[key]);
+	return encoded;
+};
+
+
+cloudeebus.encode = function(value) {
+	// args are sent as a JSON string, or as values with the native protocol
+	if (cloudeebus.protocol == "json")
+		return cloudeebus.stringifyJSON(value);
+	return cloudeebus._encodeByteArrays(value);
+};
+
+
+cloudeebus.decode = function(data) {
+	// results are received as a JSON string, or as values with the native protocol
+	if (typeof data == "string")
+		return cloudeebus.parseJSON(data);
+	return cloudeebus._decodeByteArrays(data);
+};
+
+
 cloudeebus.versionCheck = function(version) {
 	var ver = version.split(".");
 	var min = cloudeebus.minVersion.split(".");
@@ -77,7 +148,13 @@ cloudeebus.connect = function(uri, manifest, successCB, errorCB) {
 	cloudeebus.reset();
 	cloudeebus.uri = uri;
 	
-	function onCloudeebusVersionCheckCB(version) {
+	function onCloudeebusVersionCheckCB(reply) {
+		// reply is [version, protocol], or the version string for older servers
+		var version = reply;
+		if (reply instanceof Array) {
+			version = reply[0];
+			cloudeebus.protocol = reply[1];
+		}
 		if (cloudeebus.versionCheck(version)) {
 			cloudeebus.log("Connected to " + cloudeebus.uri);
 			if (successCB)
@@ -100,7 +177,7 @@ cloudeebus.connect = function(uri, manifest, successCB, errorCB) {
 	function onWAMPSessionAuthenticatedCB(permissions) {
 		cloudeebus.sessionBus = new cloudeebus.BusConnection("session", cloudeebus.wampSession);
 		cloudeebus.systemBus = new cloudeebus.BusConnection("system", cloudeebus.wampSession);
-		cloudeebus.wampSession.call("getVersion").then(onCloudeebusVersionCheckCB, errorCB);
+		cloudeebus.wampSession.call("getVersion", [cloudeebus.version, cloudeebus.protocols]).then(onCloudeebusVersionCheckCB, errorCB);
 	}
 	
 	function onWAMPSessionChallengedCB(challenge) {
@@ -153,6 +230,14 @@ cloudeebus.SystemBus = function() {
 cloudeebus.BusConnection = function(name, session) {
 	this.name = name;
 	this.wampSession = session;
+	// autoBatch: send the ProxyObject.callMethod calls of a same tick as one
+	// dbusSendBatch, with at most maxOutstanding calls waiting for their
+	// reply, 0 for no limit. Calls over the limit wait for replies.
+	this.autoBatch = false;
+	this.maxOutstanding = 0;
+	this.outstandingCalls = 0;
+	this.queuedCalls = [];
+	this.flushTimer = null;
 	return this;
 };
 
@@ -165,6 +250,221 @@ cloudeebus.BusConnection.prototype.getObject = function(busName, objectPath, int
 };
 
 
+cloudeebus.BusConnection.prototype.getManagedObjects = function(busName, objectPath, successCB, errorCB, changedCB) {
+	// builds proxies of all the objects of an ObjectManager from one server
+	// side snapshot, kept up to date. Returns the manager proxy, whose
+	// managedObjects map paths to proxies. successCB is called with the
+	// manager once hydrated, changedCB with (path, proxy, added interface
+	// names, removed interface names) as interfaces come and go, proxy
+	// being null for removed objects. Stop updates with
+	// manager.disconnectSignal("org.freedesktop.DBus.ObjectManager", "mirror").
+	var self = this;
+	var manager = new cloudeebus.ProxyObject(this.wampSession, this, busName, objectPath);
+	var interfaces = {};
+	manager.managedObjects = {};
+	
+	function addInterfaces(path, added) {
+		var proxy = manager.managedObjects[path];
+		if (!proxy)
+			proxy = manager.managedObjects[path] = new cloudeebus.ProxyObject(self.wampSession, self, busName, path);
+		for (var ifName in added)
+			proxy._addInterface({
+				name: ifName,
+				methods: interfaces[ifName] ? interfaces[ifName] : [],
+				properties: added[ifName]
+			});
+		return proxy;
+	}
+	
+	function objectsHandler(id, data) {
+		try {
+			var delta = cloudeebus.decode(data);
+			var path = delta[0];
+			var added = [];
+			for (var ifName in delta[1])
+				added.push(ifName);
+			var proxy = manager.managedObjects[path];
+			if (added.length > 0)
+				proxy = addInterfaces(path, delta[1]);
+			for (var i=0; i < delta[2].length; i++) {
+				if (proxy)
+					proxy._removeInterface(delta[2][i]);
+			}
+			if (proxy) {
+				var remaining = 0;
+				for (var ifName in proxy.interfaceProxies)
+					remaining++;
+				if (remaining == 0) {
+					delete manager.managedObjects[path];
+					proxy = null;
+				}
+			}
+			// interfaces not seen in the snapshot need introspection for their methods
+			var unknown = false;
+			for (var i=0; i < added.length; i++) {
+				if (!interfaces[added[i]])
+					unknown = true;
+			}
+			if (unknown && proxy)
+				proxy._introspect(function() {
+					if (changedCB)
+						changedCB.apply(manager, [path, proxy, added, delta[2]]);
+				}, errorCB);
+			else if (changedCB)
+				changedCB.apply(manager, [path, proxy, added, delta[2]]);
+		}
+		catch (e) {
+			var errorStr = cloudeebus.getError(e);
+			cloudeebus.log("Managed objects handler exception: " + errorStr);
+			if (errorCB)
+				errorCB(errorStr);
+		}
+	}
+	
+	function getManagedObjectsSuccessCB(str) {
+		try {
+			var snapshot = cloudeebus.decode(str);
+			interfaces = snapshot[2];
+			manager.signalIds["org.freedesktop.DBus.ObjectManager#mirror"] = snapshot[0];
+			self.wampSession.subscribe(snapshot[0], objectsHandler);
+			for (var path in snapshot[1])
+				addInterfaces(path, snapshot[1][path]);
+		}
+		catch (e) {
+			var errorStr = cloudeebus.getError(e);
+			cloudeebus.log("Managed objects exception: " + errorStr);
+			if (errorCB)
+				errorCB(errorStr);
+			return;
+		}
+		if (successCB)
+			successCB(manager);
+	}
+	
+	function getManagedObjectsErrorCB(error) {
+		var errorStr = cloudeebus.getError(error);
+		cloudeebus.log("Error getting managed objects of: " + objectPath + " : " + errorStr);
+		if (errorCB)
+			errorCB(errorStr);
+	}
+	
+	// call getManagedObjects with bus type, destination and object manager
+	this.wampSession.call("getManagedObjects", [this.name, busName, objectPath]).then(getManagedObjectsSuccessCB, getManagedObjectsErrorCB);
+	return manager;
+};
+
+
+cloudeebus.BusConnection.prototype.callMethods = function(calls) {
+	// calls: array of [busName, objectPath, ifName, method, args, [signature]]
+	// returns an array of promises, one per call, resolved from a single reply
+	var self = this;
+	var arglists = [];
+	var resolvers = [];
+	var promises = [];
+	
+	for (var i=0; i < calls.length; i++) {
+		var promise = new cloudeebus.Promise();
+		promises.push(promise);
+		resolvers.push(promise.resolver);
+		arglists.push([
+			self.name,
+			calls[i][0],
+			calls[i][1],
+			calls[i][2],
+			calls[i][3],
+			cloudeebus.encode(calls[i][4] ? calls[i][4] : [])
+		]);
+		if (calls[i][5] != undefined)
+			arglists[i].push(calls[i][5]);
+	}
+	
+	if (calls.length > 0)
+		self._sendBatch(arglists, resolvers);
+	
+	return promises;
+};
+
+
+cloudeebus.BusConnection.prototype._sendBatch = function(arglists, resolvers, doneCB) {
+	
+	// settle every promise of the batch even if a callback throws,
+	// then let the caller send its next batch
+	function settleCalls(settleCB) {
+		for (var i=0; i < resolvers.length; i++) {
+			try {
+				settleCB(i);
+			}
+			catch (e) {
+				cloudeebus.log("Method callback exception: " + cloudeebus.getError(e));
+			}
+		}
+		if (doneCB)
+			doneCB();
+	}
+	
+	function sendBatchSuccessCB(replies) {
+		settleCalls(function(i) {
+			if (replies[i][0])
+				cloudeebus.ProxyObject._fulfillCall(resolvers[i], replies[i][1]);
+			else {
+				cloudeebus.log("Error calling method: " + arglists[i][4] + " on object: " + arglists[i][2] + " : " + replies[i][1]);
+				resolvers[i].reject(replies[i][1], true);
+			}
+		});
+	}
+	
+	function sendBatchErrorCB(error) {
+		var errorStr = cloudeebus.getError(error);
+		cloudeebus.log("Error sending batch: " + errorStr);
+		settleCalls(function(i) {
+			resolvers[i].reject(errorStr, true);
+		});
+	}
+	
+	// call dbusSendBatch with a list of dbusSend argument lists
+	this.wampSession.call("dbusSendBatch", arglists).then(sendBatchSuccessCB, sendBatchErrorCB);
+};
+
+
+cloudeebus.BusConnection.prototype._queueCall = function(arglist, resolver) {
+	// queue a dbusSend argument list until the end of the current tick
+	var self = this;
+	this.queuedCalls.push([arglist, resolver]);
+	if (this.flushTimer == null)
+		this.flushTimer = setTimeout(function() {
+			self.flushTimer = null;
+			self._flushCalls();
+		}, 0);
+};
+
+
+cloudeebus.BusConnection.prototype._flushCalls = function() {
+	var self = this;
+	var count = this.queuedCalls.length;
+	if (this.maxOutstanding > 0)
+		count = Math.min(count, this.maxOutstanding - this.outstandingCalls);
+	if (count <= 0)
+		return;
+	
+	var calls = this.queuedCalls.splice(0, count);
+	var arglists = [];
+	var resolvers = [];
+	for (var i=0; i < calls.length; i++) {
+		arglists.push(calls[i][0]);
+		resolvers.push(calls[i][1]);
+	}
+	
+	function batchDoneCB() {
+		self.outstandingCalls -= count;
+		if (self.queuedCalls.length > 0)
+			self._flushCalls();
+	}
+	
+	this.outstandingCalls += count;
+	this._sendBatch(arglists, resolvers, batchDoneCB);
+};
+
+
 cloudeebus.BusConnection.prototype.addService = function(serviceName) {
 	var self = this;
 
@@ -230,6 +530,7 @@ cloudeebus.Service = function(session, busConnection, name) {
 	this.name = name;
 	this.agents = [];
 	this.isCreated = false;
+	this._pendingSignals = null;
 	return this;
 };
 
@@ -289,9 +590,7 @@ cloudeebus.Service.prototype._addMethod = function(ifName, method, agent) {
 		agent.handler.wrapperFunc[method] = function() {
 			var result;
 			var methodId = arguments[0];
-			var callDict = {};
-			// affectation of callDict in eval, otherwise dictionary(='{}') interpreted as block of code by eval
-			eval("callDict = " + arguments[1]);
+			var callDict = cloudeebus.decode(arguments[1]);
 			try {
 				result = funcToCall.apply(agent.handler, callDict.args);
 				service._returnMethod(methodId, callDict.callIndex, true, result);
@@ -440,11 +739,12 @@ cloudeebus.Service.prototype.removeAgent = function(rmAgent) {
 
 
 cloudeebus.Service.prototype._returnMethod = function(methodId, callIndex, success, result, successCB, errorCB) {
+	// results are encoded as a one element args list, errors are messages
 	var arglist = [
 	    methodId,
 	    callIndex,
 	    success,
-	    result
+	    success ? cloudeebus.encode([result === undefined ? null : result]) : result
 	    ];
 
 	this.wampSession.call("returnMethod", arglist).then(successCB, errorCB);
@@ -452,13 +752,54 @@ cloudeebus.Service.prototype._returnMethod = function(methodId, callIndex, succe
 
 
 cloudeebus.Service.prototype._emitSignal = function(objectPath, signalName, args, successCB, errorCB) {
+	var self = this;
 	var arglist = [
 	    objectPath,
 	    signalName,
-	    JSON.stringify(args)
+	    cloudeebus.encode(args)
 	    ];
 
-	this.wampSession.call("emitSignal", arglist).then(successCB, errorCB);
+	// signals emitted in the same tick are sent together with emitSignals
+	if (!self._pendingSignals) {
+		self._pendingSignals = [];
+		setTimeout(function() {
+			self._flushSignals();
+		}, 0);
+	}
+	self._pendingSignals.push([arglist, successCB, errorCB]);
+};
+
+
+cloudeebus.Service.prototype._flushSignals = function() {
+	var signals = this._pendingSignals;
+	var arglists = [];
+	this._pendingSignals = null;
+	
+	for (var i=0; i < signals.length; i++)
+		arglists.push(signals[i][0]);
+	
+	function emitSignalsSuccessCB(replies) {
+		for (var i=0; i < signals.length; i++) {
+			if (replies[i][0]) {
+				if (signals[i][1])
+					signals[i][1](null);
+			}
+			else {
+				cloudeebus.log("Error emitting signal: " + signals[i][0][1] + " on object: " + signals[i][0][0] + " : " + replies[i][1]);
+				if (signals[i][2])
+					signals[i][2](replies[i][1]);
+			}
+		}
+	}
+	
+	function emitSignalsErrorCB(error) {
+		cloudeebus.log("Error emitting signals: " + cloudeebus.getError(error));
+		for (var i=0; i < signals.length; i++)
+			if (signals[i][2])
+				signals[i][2](error);
+	}
+	
+	this.wampSession.call("emitSignals", arglists).then(emitSignalsSuccessCB, emitSignalsErrorCB);
 };
 
 
@@ -771,7 +1112,9 @@ cloudeebus.ProxyObject = function(session, busConnection, busName, objectPath) {
 	this.busName = busName; 
 	this.objectPath = objectPath; 
 	this.interfaceProxies = {};
+	this.interfaceMembers = {}; // members the object got from each interface
 	this.childNodeNames = [];
+	this.signalIds = {};
 	return this;
 };
 
@@ -785,85 +1128,89 @@ cloudeebus.ProxyObject.prototype._introspect = function(successCB, errorCB) {
 	
 	var self = this; 
 
-	function getAllPropertiesSuccessCB(props) {
-		var ifProxy = self.interfaceProxies[self.propInterfaces[self.propInterfaces.length-1]];
-		for (var prop in props)
-			ifProxy[prop] = self[prop] = props[prop];
-		getAllPropertiesNextInterfaceCB();
-	}
-	
-	function getAllPropertiesNextInterfaceCB() {
-		self.propInterfaces.pop();
-		if (self.propInterfaces.length > 0) 
-			self.callMethod("org.freedesktop.DBus.Properties", 
-				"GetAll", 
-				[self.propInterfaces[self.propInterfaces.length-1]]).then(getAllPropertiesSuccessCB, 
-				errorCB ? errorCB : getAllPropertiesNextInterfaceCB);
-		else {
-			self.propInterfaces = null;
-			if (successCB)
-				successCB(self);
-		}
-	}
-	
 	function introspectSuccessCB(str) {
-		var parser = new DOMParser();
-		var xmlDoc = parser.parseFromString(str, "text/xml");
-		var nodes = xmlDoc.getElementsByTagName("node");
-		// first node is the parent/head node
-		for(var i=1; i < nodes.length; i++)
-			self.childNodeNames.push(nodes[i].getAttribute("name"));
-		var interfaces = xmlDoc.getElementsByTagName("interface");
-		self.propInterfaces = [];
-		var supportDBusProperties = false;
-		for (var i=0; i < interfaces.length; i++) {
-			var ifName = interfaces[i].attributes.getNamedItem("name").value;
-			self.interfaceProxies[ifName] = new cloudeebus.ProxyObject(self.wampSession, self.busConnection, self.busName, self.objectPath);
-			if (ifName == "org.freedesktop.DBus.Properties")
-				supportDBusProperties = true;
-			var hasProperties = false;
-			var ifChild = interfaces[i].firstChild;
-			while (ifChild) {
-				if (ifChild.nodeName == "method") {
-					var nArgs = 0;
-					var signature = "";
-					var metChild = ifChild.firstChild;
-					while (metChild) {
-						if (metChild.nodeName == "arg" &&
-							metChild.attributes.getNamedItem("direction").value == "in") {
-								signature += metChild.attributes.getNamedItem("type").value;
-								nArgs++;
-						}
-						metChild = metChild.nextSibling;
-					}
-					var metName = ifChild.attributes.getNamedItem("name").value;
-					if (!self[metName])
-						self._addMethod(ifName, metName, nArgs, signature);
-					self.interfaceProxies[ifName]._addMethod(ifName, metName, nArgs, signature);
-				}
-				else if (ifChild.nodeName == "property") {
-					if (!hasProperties)
-						self.propInterfaces.push(ifName);
-					hasProperties = true;
-				}
-				ifChild = ifChild.nextSibling;
-			}
+		try {
+			var description = cloudeebus.decode(str);
+			for (var i=0; i < description.children.length; i++)
+				self.childNodeNames.push(description.children[i]);
+			for (var i=0; i < description.interfaces.length; i++)
+				self._addInterface(description.interfaces[i]);
 		}
-		if (supportDBusProperties && self.propInterfaces.length > 0) {
-			self.callMethod("org.freedesktop.DBus.Properties", 
-				"GetAll", 
-				[self.propInterfaces[self.propInterfaces.length-1]]).then(getAllPropertiesSuccessCB, 
-				errorCB ? errorCB : getAllPropertiesNextInterfaceCB);
+		catch (e) {
+			var errorStr = cloudeebus.getError(e);
+			cloudeebus.log("Introspection exception: " + errorStr);
+			if (errorCB)
+				errorCB(errorStr);
+			return;
 		}
-		else {
-			self.propInterfaces = null;
-			if (successCB)
-				successCB(self);
+		if (successCB)
+			successCB(self);
+	}
+
+	function introspectErrorCB(error) {
+		var errorStr = cloudeebus.getError(error);
+		cloudeebus.log("Error introspecting object: " + self.objectPath + " : " + errorStr);
+		if (errorCB)
+			errorCB(errorStr);
+	}
+
+	var arglist = [
+		self.busConnection.name,
+		self.busName,
+		self.objectPath
+	];
+
+	// call dbusIntrospect with bus type, destination and object
+	self.wampSession.call("dbusIntrospect", arglist).then(introspectSuccessCB, introspectErrorCB);
+};
+
+
+cloudeebus.ProxyObject.prototype._addInterface = function(ifDesc) {
+	// ifDesc: {name, methods: array of [name, nArgs, signature], properties}
+	if (this.interfaceProxies[ifDesc.name])
+		this._removeInterface(ifDesc.name);
+	var ifProxy = new cloudeebus.ProxyObject(this.wampSession, this.busConnection, this.busName, this.objectPath);
+	var members = this.interfaceMembers[ifDesc.name] = [];
+	this.interfaceProxies[ifDesc.name] = ifProxy;
+	for (var j=0; j < ifDesc.methods.length; j++) {
+		var metName = ifDesc.methods[j][0];
+		var nArgs = ifDesc.methods[j][1];
+		var signature = ifDesc.methods[j][2];
+		if (!this[metName]) {
+			this._addMethod(ifDesc.name, metName, nArgs, signature);
+			members.push(metName);
 		}
+		ifProxy._addMethod(ifDesc.name, metName, nArgs, signature);
 	}
+	for (var prop in ifDesc.properties) {
+		ifProxy[prop] = this[prop] = ifDesc.properties[prop];
+		members.push(prop);
+	}
+};
 
-	// call Introspect on self
-	self.callMethod("org.freedesktop.DBus.Introspectable", "Introspect", []).then(introspectSuccessCB, errorCB);
+
+cloudeebus.ProxyObject.prototype._removeInterface = function(ifName) {
+	if (!this.interfaceProxies[ifName])
+		return;
+	var members = this.interfaceMembers[ifName];
+	delete this.interfaceProxies[ifName];
+	delete this.interfaceMembers[ifName];
+	// remove the methods and property values the object got from the
+	// interface, other interfaces with the same members provide them again
+	var fields = new cloudeebus.ProxyObject();
+	for (var i=0; i < members.length; i++) {
+		var member = members[i];
+		if (fields.hasOwnProperty(member))
+			continue;
+		delete this[member];
+		for (var other in this.interfaceProxies) {
+			if (this.interfaceProxies[other].hasOwnProperty(member)) {
+				this[member] = this.interfaceProxies[other][member];
+				this.interfaceMembers[other].push(member);
+				break;
+			}
+		}
+	}
 };
 
 
@@ -880,21 +1227,14 @@ cloudeebus.ProxyObject.prototype._addMethod = function(ifName, method, nArgs, si
 };
 
 
-cloudeebus.ProxyObject.prototype.callMethod = function(ifName, method, args, signature) {
+cloudeebus.ProxyObject.prototype.callMethod = function(ifName, method, args, signature, timeout) {
+	// timeout in ms, defaults to the proxy callTimeout then to the dbus default
 	
 	var self = this;
 	
 	var promise = new cloudeebus.Promise(function (resolver) {
 		function callMethodSuccessCB(str) {
-			try { // calling dbus hook object function for un-translated types
-				var result = eval(str);
-				resolver.fulfill(result[0], true);
-			}
-			catch (e) {
-				var errorStr = cloudeebus.getError(e);
-				cloudeebus.log("Method callback exception: " + errorStr);
-				resolver.reject(errorStr, true);
-			}
+			cloudeebus.ProxyObject._fulfillCall(resolver, str);
 		}
 
 		function callMethodErrorCB(error) {
@@ -909,10 +1249,22 @@ cloudeebus.ProxyObject.prototype.callMethod = function(ifName, method, args, sig
 			self.objectPath,
 			ifName,
 			method,
-			JSON.stringify(args)
+			cloudeebus.encode(args)
 		];
+		if (timeout == undefined)
+			timeout = self.callTimeout;
+		if (signature != undefined || timeout != undefined)
+			arglist.push(signature != undefined ? signature : null);
+		if (timeout != undefined)
+			arglist.push(timeout);
+
+		// batched with the calls of the same tick in autoBatch mode
+		if (self.busConnection.autoBatch) {
+			self.busConnection._queueCall(arglist, resolver);
+			return;
+		}
 
-		// call dbusSend with bus type, destination, object, message and arguments
+		// call dbusSend with bus type, destination, object, message, arguments and signature
 		self.wampSession.call("dbusSend", arglist).then(callMethodSuccessCB, callMethodErrorCB);
 	});
 	
@@ -920,14 +1272,44 @@ cloudeebus.ProxyObject.prototype.callMethod = function(ifName, method, args, sig
 };
 
 
-cloudeebus.ProxyObject.prototype.connectToSignal = function(ifName, signal, handlerCB, errorCB) {
+cloudeebus.ProxyObject._fulfillCall = function(resolver, str) {
+	try {
+		var result = cloudeebus.decode(str);
+		resolver.fulfill(result[0], true);
+	}
+	catch (e) {
+		var errorStr = cloudeebus.getError(e);
+		cloudeebus.log("Method callback exception: " + errorStr);
+		resolver.reject(errorStr, true);
+	}
+};
+
+
+cloudeebus.ProxyObject.prototype.connectToSignal = function(ifName, signal, handlerCB, errorCB, options) {
+	// options: {policy: "latest" | "batch", interval: ms} to have signals
+	// coalesced by the server. With "batch", handlerCB is called once per
+	// interval with the array of all the signal argument arrays.
+	// options.match: {argN: string, argNpath: path} to receive only the
+	// signals whose arguments match, filtered by the bus daemon.
+	// options.subtree: true to receive the signal from all the objects under
+	// objectPath, with any sender if busName is "*". handlerCB is then called
+	// with the path of the emitting object before the signal arguments.
+	// With the "latest" policy, it is called for the last signal of each path.
 	
 	var self = this; 
 
 	function signalHandler(id, data) {
 		if (handlerCB) {
-			try { // calling dbus hook object function for un-translated types
-				handlerCB.apply(self, eval(data));
+			try {
+				if (options && options.policy == "batch")
+					handlerCB.apply(self, [cloudeebus.decode(data)]);
+				else if (options && options.policy == "latest" && options.subtree) {
+					var latest = cloudeebus.decode(data);
+					for (var i=0; i<latest.length; i++)
+						handlerCB.apply(self, latest[i]);
+				}
+				else
+					handlerCB.apply(self, cloudeebus.decode(data));
 			}
 			catch (e) {
 				var errorStr = cloudeebus.getError(e);
@@ -940,6 +1322,7 @@ cloudeebus.ProxyObject.prototype.connectToSignal = function(ifName, signal, hand
 	
 	function connectToSignalSuccessCB(str) {
 		try {
+			self.signalIds[ifName + "#" + signal] = str;
 			self.wampSession.subscribe(str, signalHandler);
 		}
 		catch (e) {
@@ -961,17 +1344,136 @@ cloudeebus.ProxyObject.prototype.connectToSignal = function(ifName, signal, hand
 		ifName,
 		signal
 	];
+	if (options)
+		arglist.push(options);
 
 	// call dbusSend with bus type, destination, object, message and arguments
 	self.wampSession.call("dbusRegister", arglist).then(connectToSignalSuccessCB, connectToSignalErrorCB);
 };
 
 
+cloudeebus.ProxyObject.prototype.onPropertiesChanged = function(ifName, handlerCB, errorCB) {
+	// keeps properties up to date from a server side mirror, handlerCB is
+	// called with (changed, invalidated) for the initial values and each delta
+	
+	var self = this;
+	
+	function updateProperties(changed, invalidated) {
+		var ifProxy = self.interfaceProxies[ifName];
+		for (var prop in changed) {
+			self[prop] = changed[prop];
+			if (ifProxy)
+				ifProxy[prop] = changed[prop];
+		}
+		for (var i=0; i < invalidated.length; i++) {
+			delete self[invalidated[i]];
+			if (ifProxy)
+				delete ifProxy[invalidated[i]];
+		}
+		if (handlerCB)
+			handlerCB.apply(self, [changed, invalidated]);
+	}
+	
+	function propertiesHandler(id, data) {
+		try {
+			var delta = cloudeebus.decode(data);
+			updateProperties(delta[0], delta[1]);
+		}
+		catch (e) {
+			var errorStr = cloudeebus.getError(e);
+			cloudeebus.log("Properties handler exception: " + errorStr);
+			if (errorCB)
+				errorCB(errorStr);
+		}
+	}
+	
+	function propertiesWatchSuccessCB(str) {
+		try {
+			var mirror = cloudeebus.decode(str);
+			self.signalIds[ifName + "#PropertiesChanged#mirror"] = mirror[0];
+			self.wampSession.subscribe(mirror[0], propertiesHandler);
+			updateProperties(mirror[1], []);
+		}
+		catch (e) {
+			var errorStr = cloudeebus.getError(e);
+			cloudeebus.log("Properties watch exception: " + errorStr);
+			if (errorCB)
+				errorCB(errorStr);
+		}
+	}
+	
+	function propertiesWatchErrorCB(error) {
+		var errorStr = cloudeebus.getError(error);
+		cloudeebus.log("Error watching properties of: " + ifName + " on object: " + self.objectPath + " : " + errorStr);
+		if (errorCB)
+			errorCB(errorStr);
+	}
+	
+	var arglist = [
+		self.busConnection.name,
+		self.busName,
+		self.objectPath,
+		ifName
+	];
+	
+	// call propertiesWatch with bus type, destination, object and interface
+	self.wampSession.call("propertiesWatch", arglist).then(propertiesWatchSuccessCB, propertiesWatchErrorCB);
+};
+
+
+cloudeebus.ProxyObject.prototype.getProperty = function(ifName, name) {
+	// reads a property from the server side mirror set up by onPropertiesChanged
+	
+	var self = this;
+	
+	var promise = new cloudeebus.Promise(function (resolver) {
+		function getPropertySuccessCB(str) {
+			cloudeebus.ProxyObject._fulfillCall(resolver, str);
+		}
+		
+		function getPropertyErrorCB(error) {
+			var errorStr = cloudeebus.getError(error);
+			cloudeebus.log("Error getting property: " + name + " on object: " + self.objectPath + " : " + errorStr);
+			resolver.reject(errorStr, true);
+		}
+		
+		var arglist = [
+			self.busConnection.name,
+			self.busName,
+			self.objectPath,
+			ifName,
+			name
+		];
+		
+		// call propertiesGet with bus type, destination, object, interface and property
+		self.wampSession.call("propertiesGet", arglist).then(getPropertySuccessCB, getPropertyErrorCB);
+	});
+	
+	return promise;
+};
+
+
+cloudeebus.ProxyObject.prototype.disconnectPropertiesChanged = function(ifName) {
+	this.disconnectSignal(ifName, "PropertiesChanged#mirror");
+};
+
+
 cloudeebus.ProxyObject.prototype.disconnectSignal = function(ifName, signal) {
+	var id = this.signalIds[ifName + "#" + signal];
+	if (!id)
+		id = this.busConnection.name + "#" + this.busName + "#" + this.objectPath + "#" + ifName + "#" + signal;
+	delete this.signalIds[ifName + "#" + signal];
 	try {
-		this.wampSession.unsubscribe(this.busConnection.name + "#" + this.busName + "#" + this.objectPath + "#" + ifName + "#" + signal);
+		this.wampSession.unsubscribe(id);
 	}
 	catch (e) {
 		cloudeebus.log("Unsubscribe error: " + cloudeebus.getError(e));
 	}
+	
+	function disconnectSignalErrorCB(error) {
+		cloudeebus.log("Error disconnecting signal: " + id + " : " + cloudeebus.getError(error));
+	}
+	
+	// release the server side signal handler
+	this.wampSession.call("dbusUnregister", [id]).then(null, disconnectSignalErrorCB);
 };
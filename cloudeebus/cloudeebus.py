@@ -22,7 +22,7 @@
 #
 
 
-import argparse, dbus, json, sys
+import argparse, dbus, json, os, shutil, socket, subprocess, sys, tempfile
 
 from twisted.internet import glib2reactor
 # Configure the twisted mainloop to be run inside the glib mainloop.
@@ -33,6 +33,10 @@ from twisted.internet import reactor
 from autobahn.websocket import listenWS
 from autobahn.wamp import WampServerFactory, WampCraServerProtocol
 
+from twisted.web import resource, server
+from twisted.internet import defer, protocol
+from twisted.protocols.basic import Int32StringReceiver
+
 from dbus.mainloop.glib import DBusGMainLoop
 
 import gobject
@@ -46,7 +50,7 @@ from twisted.python import log
 
 ###############################################################################
 
-from cloudeebusengine import VERSION, SERVICELIST, CloudeebusService, cache
+from cloudeebusengine import VERSION, SERVICELIST, CloudeebusService, cache, stats
 import cloudeebusengine
 
 OPENDOOR = False
@@ -140,11 +144,237 @@ class CloudeebusServerProtocol(WampCraServerProtocol):
     
     def connectionLost(self, reason):
         WampCraServerProtocol.connectionLost(self, reason)
+        # sessions closed before authentication have no service
+        if hasattr(self, "cloudeebusService"):
+            self.cloudeebusService.close()
         if factory.getConnectionCount() == 0:
             cache.reset()
 
 
 
+###############################################################################
+class StatsResource(resource.Resource):
+    '''
+    runtime metrics in the Prometheus text format
+    '''
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader("Content-Type", "text/plain; version=0.0.4")
+        return stats.text()
+
+
+
+###############################################################################
+# Workers sharing the listening port, with the master process as a broker of
+# dbus signals: the broker registers each signal once and sends it over a
+# Unix socket to the workers whose sessions subscribed to it.
+
+class BrokerProtocol(Int32StringReceiver):
+    '''
+    length prefixed JSON messages between the broker and a worker:
+    [ "subscribe", [bus, sender, object, interface, signal], options, protocol ]
+    [ "subscribed", <error message or null> ], answering each subscribe in order
+    [ "unsubscribe", <signal handler id> ]
+    [ "signal", <signal handler id>, <event> ]
+    '''
+    MAX_LENGTH = 256 * 1024 * 1024
+
+    def sendMessage(self, message):
+        self.sendString(json.dumps(message))
+
+
+class SignalBroker(BrokerProtocol):
+    '''
+    broker side of a worker connexion
+    '''
+    def connectionMade(self):
+        self.signalSubscriptions = {}
+
+
+    def stringReceived(self, string):
+        message = json.loads(string)
+        if message[0] == "subscribe":
+            # errors are sent back to the dbusRegister caller
+            error = None
+            try:
+                self.subscribe(message[1], message[2], message[3])
+            except Exception, e:
+                error = str(e)
+            self.sendMessage(["subscribed", error])
+            return
+        try:
+            if message[0] == "unsubscribe":
+                self.unsubscribe(message[1])
+        except Exception, e:
+            log.msg("Broker error on %s: %s" % (string, e))
+
+
+    def subscribe(self, names, options, protocol):
+        sigId = cloudeebusengine.signalId(names, options, protocol)
+        if not cache.signalHandlers.has_key(sigId):
+            cache.signalHandlers[sigId] = cloudeebusengine.DbusSignalHandler(*names, options=options, protocol=protocol)
+        # signal handlers are counted once per worker
+        if not self.signalSubscriptions.has_key(sigId):
+            cache.acquireSignalHandler(sigId)
+            self.signalSubscriptions[sigId] = True
+            self.factory.topics.setdefault(sigId, set()).add(self)
+
+
+    def unsubscribe(self, sigId):
+        if self.signalSubscriptions.pop(sigId, None):
+            cache.releaseSignalHandler(sigId)
+            workers = self.factory.topics[sigId]
+            workers.discard(self)
+            if not workers:
+                del self.factory.topics[sigId]
+
+
+    def connectionLost(self, reason):
+        for sigId in self.signalSubscriptions.keys():
+            self.unsubscribe(sigId)
+
+
+class SignalBrokerFactory(protocol.ServerFactory):
+    '''
+    engine factory of the broker, dispatching signals to the workers
+    '''
+    protocol = SignalBroker
+
+    def __init__(self):
+        self.topics = {}
+
+
+    def dispatch(self, topic, event):
+        workers = self.topics.get(topic)
+        if not workers:
+            return
+        # serialize the message once for all the workers
+        string = json.dumps(["signal", topic, event])
+        for worker in workers:
+            worker.sendString(string)
+
+
+class BrokerClient(BrokerProtocol):
+    '''
+    worker side of the broker connexion, the worker listens once connected
+    '''
+    def connectionMade(self):
+        self.pendingSubscriptions = [] # handlers waiting for "subscribed", in order
+        BrokerSignalHandler.client = self
+        cloudeebusengine.SignalHandler = BrokerSignalHandler
+        listenReusePort(self.factory.wampFactory, self.factory.port)
+
+
+    def stringReceived(self, string):
+        message = json.loads(string)
+        if message[0] == "signal":
+            self.factory.wampFactory.dispatch(message[1], message[2])
+        elif message[0] == "subscribed":
+            self.pendingSubscriptions.pop(0).subscribed(message[1])
+
+
+    def connectionLost(self, reason):
+        # the master process is gone
+        log.msg("Lost broker connexion: %s" % reason.getErrorMessage())
+        if reactor.running:
+            reactor.stop()
+
+
+class BrokerSignalHandler:
+    '''
+    signal handler of a worker, registered with the broker. dbusRegister
+    waits for ready(), which fails if the broker could not register it.
+    '''
+    client = None
+
+    def __init__(self, busName, senderName, objectName, interfaceName, signalName, options=None, protocol="json"):
+        names = [busName, senderName, objectName, interfaceName, signalName]
+        self.id = cloudeebusengine.signalId(names, options, protocol)
+        self.refCount = 0
+        self.registered = False
+        self.failure = None
+        self.waiting = []
+        BrokerSignalHandler.client.pendingSubscriptions.append(self)
+        BrokerSignalHandler.client.sendMessage(["subscribe", names, options, protocol])
+
+
+    def ready(self):
+        if self.failure is not None:
+            return defer.fail(self.failure)
+        if self.registered:
+            return defer.succeed(self.id)
+        request = defer.Deferred()
+        self.waiting.append(request)
+        return request
+
+
+    def subscribed(self, error):
+        waiting = self.waiting
+        self.waiting = []
+        if error is None:
+            self.registered = True
+            for request in waiting:
+                request.callback(self.id)
+            return
+        # the broker has no handler, the next dbusRegister creates a new one
+        self.failure = Exception(error)
+        if cache.signalHandlers.get(self.id) is self:
+            del cache.signalHandlers[self.id]
+        for request in waiting:
+            request.errback(self.failure)
+
+
+    def disconnect(self):
+        BrokerSignalHandler.client.sendMessage(["unsubscribe", self.id])
+
+
+def listenReusePort(factory, port):
+    '''
+    listen on a port shared by the workers, the kernel balances connexions
+    '''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # python 2 socket module has no SO_REUSEPORT constant, 15 on Linux
+    sock.setsockopt(socket.SOL_SOCKET, getattr(socket, "SO_REUSEPORT", 15), 1)
+    sock.bind(("", port))
+    sock.listen(50)
+    sock.setblocking(False)
+    # the reactor gets its own copy of the file descriptor
+    listeningPort = reactor.adoptStreamPort(sock.fileno(), socket.AF_INET, factory)
+    sock.close()
+    return listeningPort
+
+
+def connectBroker(path, wampFactory, port):
+    clientFactory = protocol.ClientFactory()
+    clientFactory.protocol = BrokerClient
+    clientFactory.wampFactory = wampFactory
+    clientFactory.port = port
+    reactor.connectUNIX(path, clientFactory)
+
+
+def startBroker(workers):
+    '''
+    listen for workers on a Unix socket, then start them with the same options
+    '''
+    brokerDir = tempfile.mkdtemp(prefix="cloudeebus-")
+    path = os.path.join(brokerDir, "broker")
+    cloudeebusengine.factory = SignalBrokerFactory()
+    # permissions are checked by the workers
+    cloudeebusengine.OPENDOOR = True
+    reactor.listenUNIX(path, cloudeebusengine.factory)
+    command = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ["--broker", path]
+    processes = [subprocess.Popen(command + ["--worker", str(i)]) for i in range(workers)]
+    def stopWorkers():
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        shutil.rmtree(brokerDir, True)
+    reactor.addSystemEventTrigger("before", "shutdown", stopWorkers)
+
+
+
 ###############################################################################
 
 if __name__ == '__main__':
@@ -165,6 +395,14 @@ if __name__ == '__main__':
         help='path to servicelist file (DBus services to export)')
     parser.add_argument('-n', '--netmask',
         help='netmask,IP filter (comma separated.) eg. : -n 127.0.0.1,192.168.2.0/24,10.12.16.0/255.255.255.0')
+    parser.add_argument('--stats-port',
+        help='port number to serve runtime metrics over HTTP on localhost')
+    parser.add_argument('--workers', type=int, default=1,
+        help='number of worker processes sharing the port')
+    parser.add_argument('--broker',
+        help=argparse.SUPPRESS)
+    parser.add_argument('--worker', type=int, default=0,
+        help=argparse.SUPPRESS)
     
     args = parser.parse_args(sys.argv[1:])
 
@@ -204,17 +442,32 @@ if __name__ == '__main__':
                 mask = "255.255.255.255" 
             NETMASK.append( {'ipAllowed': ipV4ToHex(ipAllowed), 'mask' : ipV4ToHex(mask)} )
 
-    uri = "ws://localhost:" + args.port
+    if args.workers > 1 and not args.broker:
+        # master process, sessions are served by the workers
+        startBroker(args.workers)
+    else:
+        uri = "ws://localhost:" + args.port
+        
+        factory = WampServerFactory(uri, debugWamp = args.debug)
+        factory.protocol = CloudeebusServerProtocol
+        factory.setProtocolOptions(allowHixie76 = True)
+        
+        # Configure cloudeebus engine for WAMP.
+        cloudeebusengine.factory = factory
+        cloudeebusengine.OPENDOOR = OPENDOOR
+        
+        if args.broker:
+            connectBroker(args.broker, factory, int(args.port))
+        else:
+            listenWS(factory)
     
-    factory = WampServerFactory(uri, debugWamp = args.debug)
-    factory.protocol = CloudeebusServerProtocol
-    factory.setProtocolOptions(allowHixie76 = True)
-
-    # Configure cloudeebus engine for WAMP.
-    cloudeebusengine.factory = factory
-    cloudeebusengine.OPENDOOR = OPENDOOR
-
-    listenWS(factory)
+    # the master serves the stats of the signals it brokers on the stats
+    # port, worker i the stats of its sessions on the next port + i
+    if args.stats_port:
+        statsPort = int(args.stats_port)
+        if args.broker:
+            statsPort += 1 + args.worker
+        reactor.listenTCP(statsPort, server.Site(StatsResource()), interface="127.0.0.1")
     
     DBusGMainLoop(set_as_default=True)
     
@@ -19,19 +19,29 @@
 # Frederic Paut <frederic.paut@intel.com>
 #
 
+import base64
+import bisect
 import dbus
+import dbus.lowlevel
 import dbus.service
+import functools
+import hashlib
 import os
 import re
 import json
+import time
+import weakref
+
+from collections import OrderedDict
 
 # enable debug log
 from twisted.python import log
 
 # XML parser module
-from xml.etree.ElementTree import XMLParser
+from xml.etree.ElementTree import XMLParser, fromstring
 
 from twisted.internet import defer
+from twisted.python.failure import Failure
 
 # The user of cloudeebusengine.py must set this to some object
 # providing a dispatch(topicUri, event) method as in WampServerFactory
@@ -44,21 +54,123 @@ if os.environ.get('CLOUDEEBUS_XWALK', False):
     def exportRpc(arg):
         arg._xwalk_rpc_id = arg.__name__
         return arg
+
+    # There is no twisted reactor in the Crosswalk extension process,
+    # timers are run by the glib main loop.
+    from gi.repository import GLib
+
+    class DelayedCall:
+        def __init__(self, delay, function, args):
+            self.function = function
+            self.args = args
+            self.sourceId = GLib.timeout_add(int(delay * 1000), self.run)
+
+        def run(self):
+            self.sourceId = None
+            self.function(*self.args)
+            return False
+
+        def active(self):
+            return self.sourceId is not None
+
+        def cancel(self):
+            GLib.source_remove(self.sourceId)
+            self.sourceId = None
+
+    def callLater(delay, function, *args):
+        return DelayedCall(delay, function, args)
+
+    # no reactor thread pool either, payloads are always encoded inline
+    deferToThread = None
 else:
     from autobahn.wamp import exportRpc
+    from twisted.internet.threads import deferToThread
 
-VERSION = "0.6.1"
+    def callLater(delay, function, *args):
+        from twisted.internet import reactor
+        return reactor.callLater(delay, function, *args)
+
+VERSION = "0.7.0"
 OPENDOOR = False
 SERVICELIST = []
+AGENT_CALL_TIMEOUT = 25 # seconds, as the dbus default call timeout
+PROXY_OBJECTS_CACHE_SIZE = 1000
+PROXY_METHODS_CACHE_SIZE = 5000
+ARGS_DECODERS_CACHE_SIZE = 1000
+AGENT_CLASSES_CACHE_SIZE = 100
+OFFLOAD_THRESHOLD = 1024 * 1024 # payloads larger than this are encoded and decoded in a thread
+STATS_PERMISSION = "org.cloudeebus.Stats" # whitelist entry needed by getStats
+LATENCY_BOUNDS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25] # seconds
+
+###############################################################################
+class LruCache:
+    '''
+    Dictionary of at most size entries, evicting the least recently used.
+    Entries belong to a group so they can be invalidated together.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.groups = {}
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries[key] = entry
+        return entry[0]
+
+
+    def set(self, key, group, value):
+        self.remove(key)
+        self.entries[key] = (value, group)
+        self.groups.setdefault(group, set()).add(key)
+        if len(self.entries) > self.size:
+            self.remove(self.entries.iterkeys().next())
+
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            keys = self.groups[entry[1]]
+            keys.discard(key)
+            if not keys:
+                del self.groups[entry[1]]
+
+
+    def invalidate(self, group):
+        for key in self.groups.pop(group, []):
+            del self.entries[key]
+
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.groups = {}
+
 
 ###############################################################################
 class DbusCache:
     '''
-    Global cache of DBus connexions and signal handlers
+    Global cache of DBus connexions, signal handlers, proxies and introspection data
     '''
     def __init__(self):
         self.dbusConnexions = {}
         self.signalHandlers = {}
+        self.subtreeMatches = {}
+        self.nameOwnerWatches = {}
+        self.ownerHandlers = {} # handlers with state of a service, by busName#serviceName
+        self.introspections = {}
+        # proxies are grouped by busName#serviceName
+        self.proxyObjects = LruCache(PROXY_OBJECTS_CACHE_SIZE)
+        self.proxyMethods = LruCache(PROXY_METHODS_CACHE_SIZE)
+        self.proxyMethodSignatures = LruCache(PROXY_METHODS_CACHE_SIZE)
+        # generated agent classes are grouped by className
+        self.agentClasses = LruCache(AGENT_CLASSES_CACHE_SIZE)
 
 
     def reset(self):
@@ -69,7 +181,57 @@ class DbusCache:
         # disconnect signal handlers
         for key in self.signalHandlers:
             self.signalHandlers[key].disconnect()
+            stats.signalReleased(key)
         self.signalHandlers = {}
+        self.subtreeMatches = {}
+        # stop watching name owners, bus connexions are shared by dbus-python
+        for key in self.nameOwnerWatches:
+            self.nameOwnerWatches[key].remove()
+        self.nameOwnerWatches = {}
+        self.ownerHandlers = {}
+        self.introspections = {}
+        self.proxyObjects.clear()
+        self.proxyMethods.clear()
+        self.proxyMethodSignatures.clear()
+        self.agentClasses.clear()
+
+
+    def acquireSignalHandler(self, sigId):
+        self.signalHandlers[sigId].refCount += 1
+
+
+    def releaseSignalHandler(self, sigId):
+        '''
+        Disconnect signal handlers no session subscribes to anymore.
+        '''
+        handler = self.signalHandlers.get(sigId)
+        if handler is None:
+            return
+        handler.refCount -= 1
+        if handler.refCount <= 0:
+            handler.disconnect()
+            del self.signalHandlers[sigId]
+            stats.signalReleased(sigId)
+
+
+    def acquireSubtreeMatch(self, busName, senderName, namespace):
+        '''
+        subtree matches hashed by busName#senderName#namespace
+        '''
+        key = "#".join([busName, senderName, namespace])
+        if not self.subtreeMatches.has_key(key):
+            self.subtreeMatches[key] = DbusSubtreeMatch(busName, senderName, namespace)
+        return self.subtreeMatches[key]
+
+
+    def releaseSubtreeMatch(self, subtree):
+        '''
+        Remove match rules no signal handler uses anymore.
+        '''
+        if subtree.handlers:
+            return
+        subtree.disconnect()
+        self.subtreeMatches.pop(subtree.id, None)
 
 
     def dbusConnexion(self, busName):
@@ -80,71 +242,1039 @@ class DbusCache:
                 self.dbusConnexions[busName] = dbus.SystemBus()
             else:
                 raise Exception("Error: invalid bus: %s" % busName)
+            self.watchNameOwners(busName)
         return self.dbusConnexions[busName]
 
+
+    def watchNameOwners(self, busName):
+        '''
+        Invalidate cached data of services whose owner changes.
+        '''
+        def nameOwnerChanged(name, oldOwner, newOwner):
+            self.nameOwnerChanged(busName, name, newOwner)
+        self.nameOwnerWatches[busName] = self.dbusConnexions[busName].add_signal_receiver(
+            nameOwnerChanged, "NameOwnerChanged", "org.freedesktop.DBus",
+            "org.freedesktop.DBus", "/org/freedesktop/DBus")
+
+
+    def nameOwnerChanged(self, busName, serviceName, owner):
+        # proxies of well-known names are bound to the previous owner
+        group = busName + "#" + serviceName
+        self.introspections.pop(group, None)
+        self.proxyObjects.invalidate(group)
+        self.proxyMethods.invalidate(group)
+        self.proxyMethodSignatures.invalidate(group)
+        # mirrors hold the state of the previous owner
+        for handler in list(self.ownerHandlers.get(group, [])):
+            handler.ownerChanged(owner)
+
+
+    def watchOwner(self, busName, serviceName, handler):
+        '''
+        handler.ownerChanged(owner) is called when the service owner changes
+        '''
+        self.ownerHandlers.setdefault(busName + "#" + serviceName, set()).add(handler)
+
+
+    def unwatchOwner(self, busName, serviceName, handler):
+        group = busName + "#" + serviceName
+        handlers = self.ownerHandlers.get(group)
+        if handlers is not None:
+            handlers.discard(handler)
+            if not handlers:
+                del self.ownerHandlers[group]
+
+
+    def introspection(self, busName, serviceName, objectName):
+        '''
+        introspection data hashed by busName#serviceName, then objectName
+        '''
+        objects = self.introspections.get(busName + "#" + serviceName)
+        if objects is None:
+            return None
+        return objects.get(objectName)
+
+
+    def setIntrospection(self, busName, serviceName, objectName, introspection):
+        objects = self.introspections.setdefault(busName + "#" + serviceName, {})
+        objects[objectName] = introspection
+
 cache = DbusCache()
 
 
+
+###############################################################################
+class Histogram:
+    '''
+    count of observed values by upper bound, last count is above all bounds
+    '''
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+    def snapshot(self):
+        return {'bounds': self.bounds, 'counts': self.counts[:], 'sum': self.sum, 'count': self.count}
+
+
+###############################################################################
+class Stats:
+    '''
+    Runtime metrics of the engine, shared by all sessions
+    '''
+    def __init__(self):
+        self.sessions = weakref.WeakSet()
+        self.reset()
+
+
+    def reset(self):
+        self.rpcCalls = {}
+        self.rpcErrors = {}
+        self.rpcLatency = {}
+        self.dbusLatency = {}
+        self.signalsDispatched = {}
+        self.agentCallsExpired = 0
+
+
+    def rpcDone(self, name, start, success):
+        self.rpcCalls[name] = self.rpcCalls.get(name, 0) + 1
+        if not success:
+            self.rpcErrors[name] = self.rpcErrors.get(name, 0) + 1
+        histogram = self.rpcLatency.get(name)
+        if histogram is None:
+            histogram = self.rpcLatency[name] = Histogram()
+        histogram.observe(time.time() - start)
+
+
+    def rpcResult(self, result, name, start):
+        '''
+        deferred callback and errback, passing the result through
+        '''
+        self.rpcDone(name, start, not isinstance(result, Failure))
+        return result
+
+
+    def dbusReply(self, destination, start):
+        # unique names are short lived, they share one label
+        if destination.startswith(":"):
+            destination = ":unique"
+        histogram = self.dbusLatency.get(destination)
+        if histogram is None:
+            histogram = self.dbusLatency[destination] = Histogram()
+        histogram.observe(time.time() - start)
+
+
+    def signalDispatched(self, topic):
+        self.signalsDispatched[topic] = self.signalsDispatched.get(topic, 0) + 1
+
+
+    def signalReleased(self, topic):
+        '''
+        topics are dropped with their signal handler
+        '''
+        self.signalsDispatched.pop(topic, None)
+
+
+    def snapshot(self):
+        '''
+        metrics as a JSON compatible dictionary
+        '''
+        caches = {}
+        for name in ["proxyObjects", "proxyMethods", "proxyMethodSignatures", "agentClasses"]:
+            lru = getattr(cache, name)
+            caches[name] = {'hits': lru.hits, 'misses': lru.misses, 'size': len(lru.entries)}
+        sessions = list(self.sessions)
+        return {
+            'version': VERSION,
+            'rpc': dict([(name, {
+                'calls': self.rpcCalls[name],
+                'errors': self.rpcErrors.get(name, 0),
+                'latency': self.rpcLatency[name].snapshot()})
+                for name in self.rpcCalls]),
+            'dbusLatency': dict([(name, histogram.snapshot()) for (name, histogram) in self.dbusLatency.iteritems()]),
+            'signalsDispatched': dict(self.signalsDispatched),
+            'sessions': len(sessions),
+            'pendingCalls': sum([len(session.pendingCalls) for session in sessions]),
+            'agentPendingCalls': sum([len(session.servicePendingCalls) for session in sessions]),
+            'agentCallsExpired': self.agentCallsExpired,
+            'caches': caches,
+            'signalHandlers': len(cache.signalHandlers)
+        }
+
+
+    def text(self):
+        '''
+        metrics in the Prometheus text exposition format
+        '''
+        snapshot = self.snapshot()
+        lines = []
+        def metric(name, type, samples):
+            lines.append("# TYPE cloudeebus_%s %s" % (name, type))
+            for (labels, value) in samples:
+                lines.append("cloudeebus_%s%s %s" % (name, labels, value))
+        def histogram(name, label, histograms):
+            samples = []
+            for (key, values) in histograms:
+                cumulated = 0
+                for (bound, count) in zip(values['bounds'] + ["+Inf"], values['counts']):
+                    cumulated += count
+                    samples.append(('_bucket{%s,le="%s"}' % (label(key), bound), cumulated))
+                samples.append(('_sum{%s}' % label(key), repr(values['sum'])))
+                samples.append(('_count{%s}' % label(key), values['count']))
+            lines.append("# TYPE cloudeebus_%s histogram" % name)
+            for (suffix, value) in samples:
+                lines.append("cloudeebus_%s%s %s" % (name, suffix, value))
+        methodLabel = lambda name: 'method="%s"' % promLabel(name)
+        metric("rpc_calls_total", "counter",
+               [("{%s}" % methodLabel(name), rpc['calls']) for (name, rpc) in snapshot['rpc'].iteritems()])
+        metric("rpc_errors_total", "counter",
+               [("{%s}" % methodLabel(name), rpc['errors']) for (name, rpc) in snapshot['rpc'].iteritems()])
+        histogram("rpc_latency_seconds", methodLabel,
+                  [(name, rpc['latency']) for (name, rpc) in snapshot['rpc'].iteritems()])
+        histogram("dbus_latency_seconds", lambda name: 'destination="%s"' % promLabel(name),
+                  snapshot['dbusLatency'].items())
+        metric("signals_dispatched_total", "counter",
+               [('{topic="%s"}' % promLabel(topic), count) for (topic, count) in snapshot['signalsDispatched'].iteritems()])
+        metric("sessions", "gauge", [("", snapshot['sessions'])])
+        metric("pending_calls", "gauge", [("", snapshot['pendingCalls'])])
+        metric("agent_pending_calls", "gauge", [("", snapshot['agentPendingCalls'])])
+        metric("agent_calls_expired_total", "counter", [("", snapshot['agentCallsExpired'])])
+        for (key, type) in [('hits', "counter"), ('misses', "counter"), ('size', "gauge")]:
+            suffix = key if type == "gauge" else key + "_total"
+            metric("cache_" + suffix, type,
+                   [('{cache="%s"}' % name, values[key]) for (name, values) in snapshot['caches'].iteritems()])
+        metric("signal_handlers", "gauge", [("", snapshot['signalHandlers'])])
+        return "\n".join(lines).encode('utf-8') + "\n"
+
+
+def promLabel(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def timedRpc(method):
+    '''
+    count calls of an RPC method, failures and latency until its result is ready
+    '''
+    name = method.__name__
+    @functools.wraps(method)
+    def timed(self, *args):
+        start = time.time()
+        try:
+            result = method(self, *args)
+        except:
+            stats.rpcDone(name, start, False)
+            raise
+        if isinstance(result, defer.Deferred):
+            result.addBoth(stats.rpcResult, name, start)
+        else:
+            stats.rpcDone(name, start, True)
+        return result
+    return timed
+
+stats = Stats()
+
+
+###############################################################################
+SIGNAL_POLICIES = ["latest", "batch"]
+
+patternObjectPath = re.compile('^(/|(/[A-Za-z0-9_]+)+)$')
+patternBusName = re.compile('^[A-Za-z0-9_.:-]+$')
+
+# argN and argNpath match keys, N from 0 to 63
+patternSignalMatch = re.compile('^arg([0-9]|[1-5][0-9]|6[0-3])(path)?$')
+
+def signalMatch(options):
+    '''
+    dbus argument matches of options["match"], argN matches can be passed
+    as add_signal_receiver keywords
+    '''
+    match = {}
+    if options and options.get("match"):
+        for (key, value) in options["match"].iteritems():
+            if not patternSignalMatch.match(key):
+                raise Exception("Error: invalid signal match: %s" % key)
+            if not isinstance(value, basestring):
+                raise Exception("Error: invalid signal match value for %s: %s" % (key, value))
+            match[str(key)] = value
+    return match
+
+
+def argsMatch(args, match):
+    '''
+    check signal args against argN and argNpath matches, as the bus daemon does
+    '''
+    for (key, value) in match.iteritems():
+        index = int(patternSignalMatch.match(key).group(1))
+        if index >= len(args) or not isinstance(args[index], basestring) or isinstance(args[index], dbus.ByteArray):
+            return False
+        arg = args[index]
+        if not key.endswith("path"):
+            if arg != value:
+                return False
+        elif not (arg == value or value.endswith("/") and arg.startswith(value) or
+                  arg.endswith("/") and value.startswith(arg)):
+            return False
+    return True
+
+
+def matchRuleValue(value):
+    '''
+    quote a match rule value, single quotes are escaped as '\\''
+    '''
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    return "'" + value.replace("'", "'\\''") + "'"
+
+
+def signalId(names, options, protocol="json"):
+    '''
+    signal hash id as busName#senderName#objectName#interfaceName#signalName,
+    followed by #protocol if not json, #subtree for path namespaces,
+    #{"argN":value,...} for argument matches, as JSON with sorted keys so that
+    values cannot be confused with other matches, and #policy:interval for
+    coalesced signals
+    '''
+    id = protocolId("#".join(names), protocol)
+    match = signalMatch(options)
+    if options and options.get("subtree"):
+        if match:
+            raise Exception("Error: argument matches are not supported on subtree signals")
+        id += "#subtree"
+    if match:
+        id += "#" + json.dumps(match, sort_keys=True, separators=(",", ":"))
+    if options and options.get("policy"):
+        if options["policy"] not in SIGNAL_POLICIES:
+            raise Exception("Error: invalid signal policy: %s" % options["policy"])
+        interval = int(options.get("interval", 0))
+        if interval <= 0:
+            raise Exception("Error: invalid signal interval: %s" % options.get("interval"))
+        id += "#%s:%d" % (options["policy"], interval)
+    return id
+
+
+def protocolId(id, protocol):
+    '''
+    handlers publishing to sessions of another protocol than json are
+    suffixed with #protocol
+    '''
+    if protocol == "json":
+        return id
+    return id + "#" + protocol
+
+
+
 ###############################################################################
 class DbusSignalHandler:
     '''
-    signal hash id as busName#senderName#objectName#interfaceName#signalName
+    publish dbus signals, either each one as it comes or coalesced within
+    an interval in ms: "latest" keeps the last args only, "batch" publishes
+    the list of all args received. With the subtree option, objectName is a
+    path namespace, senderName may be "" or "*" for any sender, and the path
+    of the emitting object is published before the args. "latest" then keeps
+    the last args of each path, and publishes them as a list.
     '''
-    def __init__(self, busName, senderName, objectName, interfaceName, signalName):
-        self.id = "#".join([busName, senderName, objectName, interfaceName, signalName])
-        # connect handler to signal
+    def __init__(self, busName, senderName, objectName, interfaceName, signalName, options=None, protocol="json"):
+        self.id = signalId([busName, senderName, objectName, interfaceName, signalName], options, protocol)
+        self.encode = PROTOCOL_ENCODERS[protocol]
+        self.senderName = senderName
+        self.objectName = objectName
+        self.interfaceName = interfaceName
+        self.signalName = signalName
+        self.match = signalMatch(options)
+        self.refCount = 0
+        self.policy = None
+        self.delayedCall = None
+        if options and options.get("policy"):
+            self.policy = options["policy"]
+            self.interval = int(options["interval"]) / 1000.0
+            self.queued = []
+        self.subtree = None
+        self.pathMatch = None
+        if options and options.get("subtree"):
+            # subtree handlers share one match rule per namespace
+            if senderName == "*":
+                senderName = ""
+            self.subtree = cache.acquireSubtreeMatch(busName, senderName, objectName)
+            self.subtree.add(self)
+            return
+        if [key for key in self.match if key.endswith("path")]:
+            # add_signal_receiver has no argNpath keywords
+            self.pathMatch = DbusPathMatch(busName, senderName, objectName, interfaceName, signalName, self.match, self)
+            return
+        # connect handler to signal, argument matches are part of the match rule
         self.bus = cache.dbusConnexion(busName)
-        self.bus.add_signal_receiver(self.handleSignal, signalName, interfaceName, senderName, objectName)
+        self.bus.add_signal_receiver(self.handleSignal, signalName, interfaceName, senderName, objectName,
+                                     byte_arrays=True, **self.match)
         
     
     def disconnect(self):
-        names = self.id.split("#")
-        self.bus.remove_signal_receiver(self.handleSignal, names[4], names[3], names[1], names[2])
+        if self.subtree is not None:
+            self.subtree.remove(self)
+            cache.releaseSubtreeMatch(self.subtree)
+        elif self.pathMatch is not None:
+            self.pathMatch.disconnect()
+        else:
+            self.bus.remove_signal_receiver(self.handleSignal, self.signalName, self.interfaceName, self.senderName, self.objectName,
+                                            **self.match)
+        if self.delayedCall is not None and self.delayedCall.active():
+            self.delayedCall.cancel()
+        self.delayedCall = None
 
 
     def handleSignal(self, *args):
         '''
         publish dbus args under topic hash id
         '''
-        factory.dispatch(self.id, json.dumps(args))
+        if self.policy is None:
+            stats.signalDispatched(self.id)
+            factory.dispatch(self.id, self.encode(args))
+            return
+        if self.policy == "latest" and self.subtree is not None:
+            # args start with the path of the emitting object
+            if not self.queued:
+                self.queued = OrderedDict()
+            self.queued.pop(args[0], None)
+            self.queued[args[0]] = args
+        elif self.policy == "latest":
+            self.queued = args
+        else:
+            self.queued.append(args)
+        if self.delayedCall is None:
+            self.delayedCall = callLater(self.interval, self.flush)
+
+
+    def flush(self):
+        '''
+        publish signals coalesced during the interval
+        '''
+        self.delayedCall = None
+        queued = self.queued
+        self.queued = []
+        if isinstance(queued, OrderedDict):
+            queued = queued.values()
+        stats.signalDispatched(self.id)
+        factory.dispatch(self.id, self.encode(queued))
+
+
+###############################################################################
+class DbusSubtreeMatch:
+    '''
+    single match rule on the signals of an object path namespace, messages
+    are dispatched in process to the signal handlers by interface and member
+    '''
+    def __init__(self, busName, senderName, namespace):
+        if not patternObjectPath.match(namespace):
+            raise Exception("Error: invalid path namespace: %s" % namespace)
+        if senderName and not patternBusName.match(senderName):
+            raise Exception("Error: invalid sender: %s" % senderName)
+        self.id = "#".join([busName, senderName, namespace])
+        self.senderName = senderName
+        self.namespace = namespace
+        self.prefix = namespace.rstrip("/") + "/"
+        self.handlers = {}
+        self.owner = None
+        self.ownerWatch = None
+        self.bus = cache.dbusConnexion(busName)
+        self.rule = "type='signal',path_namespace='%s'" % namespace
+        if senderName:
+            self.rule += ",sender='%s'" % senderName
+            # signals carry the unique name of the sender
+            if senderName.startswith(":"):
+                self.owner = senderName
+            else:
+                self.ownerWatch = self.bus.watch_name_owner(senderName, self.ownerChanged)
+        self.bus.add_match_string(self.rule)
+        self.bus.add_message_filter(self.filterMessage)
+
+
+    def disconnect(self):
+        self.bus.remove_message_filter(self.filterMessage)
+        self.bus.remove_match_string(self.rule)
+        if self.ownerWatch is not None:
+            self.ownerWatch.cancel()
+            self.ownerWatch = None
+
+
+    def add(self, handler):
+        key = (handler.interfaceName, handler.signalName)
+        self.handlers.setdefault(key, set()).add(handler)
+
+
+    def remove(self, handler):
+        key = (handler.interfaceName, handler.signalName)
+        handlers = self.handlers.get(key)
+        if handlers is not None:
+            handlers.discard(handler)
+            if not handlers:
+                del self.handlers[key]
+
+
+    def ownerChanged(self, owner):
+        self.owner = owner or None
+
+
+    def filterMessage(self, bus, message):
+        '''
+        pass the path and args of subtree signals to their handlers,
+        other messages are left to the other filters of the connexion
+        '''
+        if message.get_type() != dbus.lowlevel.MESSAGE_TYPE_SIGNAL:
+            return
+        path = message.get_path()
+        if path != self.namespace and not path.startswith(self.prefix):
+            return
+        if self.senderName and message.get_sender() != self.owner:
+            return
+        handlers = self.handlers.get((message.get_interface(), message.get_member()))
+        if not handlers:
+            return
+        args = message.get_args_list(byte_arrays=True)
+        for handler in list(handlers):
+            handler.handleSignal(path, *args)
+
+
+###############################################################################
+class DbusPathMatch:
+    '''
+    match rule with argNpath matches, which dbus-python signal receivers do
+    not support. The rule is added as is, and its signals are passed to the
+    signal handler from a message filter.
+    '''
+    def __init__(self, busName, senderName, objectName, interfaceName, signalName, match, handler):
+        self.senderName = senderName
+        self.objectName = objectName
+        self.interfaceName = interfaceName
+        self.signalName = signalName
+        self.match = match
+        self.handler = handler
+        self.owner = None
+        self.ownerWatch = None
+        self.bus = cache.dbusConnexion(busName)
+        rule = ["type='signal'"]
+        for (key, value) in [("sender", senderName), ("path", objectName),
+                             ("interface", interfaceName), ("member", signalName)] + sorted(match.items()):
+            if value:
+                rule.append("%s=%s" % (key, matchRuleValue(value)))
+        self.rule = ",".join(rule)
+        if senderName:
+            # signals carry the unique name of the sender
+            if senderName.startswith(":"):
+                self.owner = senderName
+            else:
+                self.ownerWatch = self.bus.watch_name_owner(senderName, self.ownerChanged)
+        self.bus.add_match_string(self.rule)
+        self.bus.add_message_filter(self.filterMessage)
+
+
+    def disconnect(self):
+        self.bus.remove_message_filter(self.filterMessage)
+        self.bus.remove_match_string(self.rule)
+        if self.ownerWatch is not None:
+            self.ownerWatch.cancel()
+            self.ownerWatch = None
+
+
+    def ownerChanged(self, owner):
+        self.owner = owner or None
+
+
+    def filterMessage(self, bus, message):
+        '''
+        pass the args of matching signals to the handler, the connexion also
+        receives the messages of its other match rules
+        '''
+        if message.get_type() != dbus.lowlevel.MESSAGE_TYPE_SIGNAL:
+            return
+        if self.interfaceName and message.get_interface() != self.interfaceName:
+            return
+        if self.signalName and message.get_member() != self.signalName:
+            return
+        if self.objectName and message.get_path() != self.objectName:
+            return
+        if self.senderName and message.get_sender() != self.owner:
+            return
+        args = message.get_args_list(byte_arrays=True)
+        if argsMatch(args, self.match):
+            self.handler.handleSignal(*args)
+
+
+# Class of the signal handlers created by dbusRegister. Processes can replace
+# it by a class with the same constructor, id, refCount and disconnect(), to
+# receive signals through another process. Such a class may add ready(),
+# a deferred that dbusRegister returns once the signal is registered.
+SignalHandler = DbusSignalHandler
+
+
+
+###############################################################################
+class DbusPropertyMirror:
+    '''
+    mirror of the properties of an object interface, seeded with GetAll and
+    updated from PropertiesChanged. Deltas are published as [changed, invalidated]
+    under hash id busName#serviceName#objectName#interfaceName#PropertiesChanged#mirror.
+    The mirror is seeded again when the service owner changes.
+    '''
+    def __init__(self, busName, serviceName, objectName, interfaceName, getAll, protocol="json"):
+        self.id = protocolId("#".join([busName, serviceName, objectName, interfaceName, "PropertiesChanged", "mirror"]), protocol)
+        self.encode = PROTOCOL_ENCODERS[protocol]
+        self.busName = busName
+        self.serviceName = serviceName
+        self.objectName = objectName
+        self.interfaceName = interfaceName
+        self.refCount = 0
+        self.properties = None
+        self.previous = None
+        self.failure = None
+        self.waiting = []
+        self.seeds = 0
+        # connect before seeding, changes received until then are part of the GetAll reply
+        self.bus = cache.dbusConnexion(busName)
+        self.bus.add_signal_receiver(self.propertiesChanged, "PropertiesChanged",
+                                     "org.freedesktop.DBus.Properties", serviceName, objectName,
+                                     byte_arrays=True)
+        cache.watchOwner(busName, serviceName, self)
+        self.seedFrom(getAll)
+
+
+    def disconnect(self):
+        self.bus.remove_signal_receiver(self.propertiesChanged, "PropertiesChanged",
+                                        "org.freedesktop.DBus.Properties", self.serviceName, self.objectName)
+        cache.unwatchOwner(self.busName, self.serviceName, self)
+
+
+    def seedFrom(self, getAll):
+        '''
+        replies of previous seeds are ignored
+        '''
+        self.seeds += 1
+        request = dbusCall(getAll, [self.interfaceName])
+        request.addCallbacks(self.seed, self.seedError, callbackArgs=(self.seeds,), errbackArgs=(self.seeds,))
+
+
+    def ownerChanged(self, owner):
+        '''
+        seed again from the new owner, subscribers get the differences with
+        the previous values as a delta. The mirror fails while the service
+        has no owner, so that the next propertiesWatch rebuilds it.
+        '''
+        if self.properties is not None:
+            self.previous = self.properties
+        self.properties = None
+        self.failure = None
+        if owner:
+            obj = self.bus.get_object(owner, self.objectName, introspect=False)
+            self.seedFrom(obj.get_dbus_method("GetAll", "org.freedesktop.DBus.Properties"))
+            return
+        self.seeds += 1
+        self.seedError(Failure(Exception("Error: service has no owner: " + self.serviceName)), self.seeds)
+        self.publishReseed({})
+        # values of the next owner are all new
+        self.previous = {}
+
+
+    def publishReseed(self, properties):
+        if self.previous is None:
+            return
+        invalidated = [name for name in self.previous if not properties.has_key(name)]
+        self.previous = None
+        stats.signalDispatched(self.id)
+        factory.dispatch(self.id, self.encode([properties, invalidated]))
+
+
+    def seed(self, result, seed):
+        if seed != self.seeds:
+            return
+        self.properties = dict(result[0])
+        self.publishReseed(self.properties)
+        waiting = self.waiting
+        self.waiting = []
+        for request in waiting:
+            request.callback(self.properties)
+
+
+    def seedError(self, failure, seed):
+        if seed != self.seeds:
+            return
+        self.failure = failure
+        waiting = self.waiting
+        self.waiting = []
+        for request in waiting:
+            request.errback(failure.value)
+
+
+    def ready(self):
+        '''
+        return a deferred fired with the properties once seeded
+        '''
+        if self.failure is not None:
+            return defer.fail(self.failure.value)
+        if self.properties is not None:
+            return defer.succeed(self.properties)
+        request = defer.Deferred()
+        self.waiting.append(request)
+        return request
+
+
+    def propertiesChanged(self, interfaceName, changed, invalidated):
+        '''
+        update the mirror and publish the delta
+        '''
+        if interfaceName != self.interfaceName or self.properties is None:
+            return
+        self.properties.update(changed)
+        for name in invalidated:
+            self.properties.pop(name, None)
+        stats.signalDispatched(self.id)
+        factory.dispatch(self.id, self.encode([changed, invalidated]))
+
+
+
+###############################################################################
+class DbusObjectManagerMirror:
+    '''
+    mirror of the objects of an ObjectManager, seeded with GetManagedObjects and
+    updated from InterfacesAdded and InterfacesRemoved. Deltas are published as
+    [path, added interfaces with their properties, removed interface names]
+    under hash id busName#serviceName#objectName#org.freedesktop.DBus.ObjectManager#mirror.
+    Property values follow PropertiesChanged under objectName, so that later
+    snapshots are current. The mirror is seeded again when the service owner changes.
+    '''
+    # PropertiesChanged of the managed objects come from a subtree match
+    interfaceName = "org.freedesktop.DBus.Properties"
+    signalName = "PropertiesChanged"
+
+    def __init__(self, busName, serviceName, objectName, getManagedObjects, protocol="json"):
+        self.id = protocolId("#".join([busName, serviceName, objectName, "org.freedesktop.DBus.ObjectManager", "mirror"]), protocol)
+        self.encode = PROTOCOL_ENCODERS[protocol]
+        self.busName = busName
+        self.serviceName = serviceName
+        self.objectName = objectName
+        self.refCount = 0
+        self.objects = None
+        self.previous = None
+        self.failure = None
+        self.waiting = []
+        self.seeds = 0
+        # connect before seeding, changes received until then are part of the GetManagedObjects reply
+        self.bus = cache.dbusConnexion(busName)
+        self.bus.add_signal_receiver(self.interfacesAdded, "InterfacesAdded",
+                                     "org.freedesktop.DBus.ObjectManager", serviceName, objectName,
+                                     byte_arrays=True)
+        self.bus.add_signal_receiver(self.interfacesRemoved, "InterfacesRemoved",
+                                     "org.freedesktop.DBus.ObjectManager", serviceName, objectName)
+        self.subtree = cache.acquireSubtreeMatch(busName, serviceName, objectName)
+        self.subtree.add(self)
+        cache.watchOwner(busName, serviceName, self)
+        self.seedFrom(getManagedObjects)
+
+
+    def disconnect(self):
+        self.bus.remove_signal_receiver(self.interfacesAdded, "InterfacesAdded",
+                                        "org.freedesktop.DBus.ObjectManager", self.serviceName, self.objectName)
+        self.bus.remove_signal_receiver(self.interfacesRemoved, "InterfacesRemoved",
+                                        "org.freedesktop.DBus.ObjectManager", self.serviceName, self.objectName)
+        self.subtree.remove(self)
+        cache.releaseSubtreeMatch(self.subtree)
+        cache.unwatchOwner(self.busName, self.serviceName, self)
+
+
+    def handleSignal(self, path, interfaceName, changed, invalidated):
+        '''
+        update the property values of a managed object, subscribers watch
+        the properties they need with propertiesWatch
+        '''
+        if self.objects is None:
+            return
+        properties = self.objects.get(path, {}).get(interfaceName)
+        if properties is None:
+            return
+        properties.update(changed)
+        for name in invalidated:
+            properties.pop(name, None)
+
+
+    def seedFrom(self, getManagedObjects):
+        '''
+        replies of previous seeds are ignored
+        '''
+        self.seeds += 1
+        request = dbusCall(getManagedObjects, [])
+        request.addCallbacks(self.seed, self.seedError, callbackArgs=(self.seeds,), errbackArgs=(self.seeds,))
+
+
+    def ownerChanged(self, owner):
+        '''
+        seed again from the new owner, subscribers get the interfaces removed
+        and the objects added or changed as deltas. The mirror fails while
+        the service has no owner, so that the next getManagedObjects rebuilds it.
+        '''
+        if self.objects is not None:
+            self.previous = self.objects
+        self.objects = None
+        self.failure = None
+        if owner:
+            obj = self.bus.get_object(owner, self.objectName, introspect=False)
+            self.seedFrom(obj.get_dbus_method("GetManagedObjects", "org.freedesktop.DBus.ObjectManager"))
+            return
+        self.seeds += 1
+        self.seedError(Failure(Exception("Error: service has no owner: " + self.serviceName)), self.seeds)
+        self.publishReseed({})
+        # objects of the next owner are all new
+        self.previous = {}
+
+
+    def publishReseed(self, objects):
+        if self.previous is None:
+            return
+        previous = self.previous
+        self.previous = None
+        for (path, interfaces) in previous.iteritems():
+            removed = [name for name in interfaces if not objects.get(path, {}).has_key(name)]
+            if removed:
+                stats.signalDispatched(self.id)
+                factory.dispatch(self.id, self.encode([path, {}, removed]))
+        for (path, interfaces) in objects.iteritems():
+            previousInterfaces = previous.get(path, {})
+            added = dict((name, properties) for (name, properties) in interfaces.iteritems()
+                         if previousInterfaces.get(name) != properties)
+            if added:
+                stats.signalDispatched(self.id)
+                factory.dispatch(self.id, self.encode([path, added, []]))
+
+
+    def seed(self, result, seed):
+        if seed != self.seeds:
+            return
+        self.objects = dict((path, dict(interfaces)) for (path, interfaces) in result[0].iteritems())
+        self.publishReseed(self.objects)
+        waiting = self.waiting
+        self.waiting = []
+        for request in waiting:
+            request.callback(self.objects)
+
+
+    def seedError(self, failure, seed):
+        if seed != self.seeds:
+            return
+        self.failure = failure
+        waiting = self.waiting
+        self.waiting = []
+        for request in waiting:
+            request.errback(failure.value)
+
+
+    def ready(self):
+        '''
+        return a deferred fired with the objects once seeded
+        '''
+        if self.failure is not None:
+            return defer.fail(self.failure.value)
+        if self.objects is not None:
+            return defer.succeed(self.objects)
+        request = defer.Deferred()
+        self.waiting.append(request)
+        return request
+
+
+    def interfacesAdded(self, path, interfaces):
+        '''
+        update the mirror and publish the added interfaces
+        '''
+        if self.objects is None:
+            return
+        self.objects.setdefault(path, {}).update(interfaces)
+        stats.signalDispatched(self.id)
+        factory.dispatch(self.id, self.encode([path, interfaces, []]))
+
+
+    def interfacesRemoved(self, path, interfaces):
+        '''
+        update the mirror and publish the removed interface names,
+        objects without interfaces are removed
+        '''
+        if self.objects is None:
+            return
+        objectInterfaces = self.objects.get(path, {})
+        for name in interfaces:
+            objectInterfaces.pop(name, None)
+        if not objectInterfaces:
+            self.objects.pop(path, None)
+        stats.signalDispatched(self.id)
+        factory.dispatch(self.id, self.encode([path, {}, interfaces]))
 
 
 
 ###############################################################################
 class DbusCallHandler:
     '''
-    deferred reply to return dbus results
+    deferred reply to return dbus results. The handler stays in the pending
+    calls table until the dbus reply, error or timeout, or its cancellation.
     '''
-    def __init__(self, method, args):
+    def __init__(self, method, args, signature=None, timeout=None, encode=None, destination=None):
         self.pending = False
+        self.destination = destination
+        self.encode = encode or dbusJsonDumps
         self.request = defer.Deferred()
         self.method = method
         self.args = args
+        self.signature = signature
+        self.timeout = timeout
+        self.pendingCalls = None
 
 
-    def callMethod(self):
+    def callMethod(self, pendingCalls=None, id=None):
         '''
-        dbus method async call
+        dbus method async call, marshalled following signature if known,
+        timeout in seconds as a deadline for dbus to answer
         '''
+        keywords = {'reply_handler': self.dbusSuccess, 'error_handler': self.dbusError, 'byte_arrays': True}
+        if self.signature is not None:
+            keywords['signature'] = self.signature
+        if self.timeout is not None:
+            keywords['timeout'] = self.timeout
         self.pending = True
-        self.method(*self.args, reply_handler=self.dbusSuccess, error_handler=self.dbusError)
+        self.start = time.time()
+        if pendingCalls is not None:
+            self.pendingCalls = pendingCalls
+            self.id = id
+            pendingCalls[id] = self
+        try:
+            self.method(*self.args, **keywords)
+        except:
+            self.done()
+            raise
         return self.request
 
 
+    def done(self):
+        self.pending = False
+        if self.pendingCalls is not None:
+            self.pendingCalls.pop(self.id, None)
+
+
     def dbusSuccess(self, *result):
         '''
-        return JSON string result array
+        return result array, as a JSON string by default
         '''
-        self.request.callback(json.dumps(result))
-        self.pending = False
+        if not self.pending:
+            return
+        self.done()
+        if self.destination is not None:
+            stats.dbusReply(self.destination, self.start)
+        if offloaded(payloadSize(result)):
+            deferToThread(self.encode, result).chainDeferred(self.request)
+        else:
+            self.request.callback(self.encode(result))
 
 
     def dbusError(self, error):
         '''
         return dbus error message
         '''
+        if not self.pending:
+            return
+        self.done()
+        if self.destination is not None:
+            stats.dbusReply(self.destination, self.start)
         self.request.errback(Exception(error.get_dbus_message()))
-        self.pending = False
+
+
+    def cancel(self):
+        '''
+        fail the request, the dbus reply will be ignored
+        '''
+        if not self.pending:
+            return
+        self.done()
+        self.request.errback(Exception("Error: call cancelled"))
+
+
+
+###############################################################################
+def payloadSize(values, limit=None):
+    '''
+    rough encoded size in bytes of a list of values, walking nested containers.
+    Counting stops once the size exceeds limit, OFFLOAD_THRESHOLD by default
+    '''
+    if limit is None:
+        limit = OFFLOAD_THRESHOLD
+    size = 0
+    pending = [values]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, basestring):
+            size += len(value) + 2
+        elif isinstance(value, dict):
+            size += 2
+            pending.extend(value.keys())
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            size += 2
+            pending.extend(value)
+        else:
+            size += 8
+        if size > limit:
+            break
+    return size
+
+
+def offloaded(size):
+    '''
+    large payloads are encoded and decoded in the reactor thread pool, so that
+    other sessions are served meanwhile
+    '''
+    return deferToThread is not None and size > OFFLOAD_THRESHOLD
+
+
+
+###############################################################################
+def dbusCall(method, args):
+    '''
+    dbus method async call, the deferred fires with the dbus result tuple
+    '''
+    request = defer.Deferred()
+    method(*args, byte_arrays=True,
+           reply_handler=lambda *result: request.callback(result),
+           error_handler=lambda error: request.errback(Exception(error.get_dbus_message())))
+    return request
+
+
+
+###############################################################################
+def parseIntrospection(xml):
+    '''
+    parse introspection XML into child node names, and interfaces with their
+    methods as [name, number of in args, in signature] and property flag
+    '''
+    if isinstance(xml, unicode):
+        xml = xml.encode("utf-8")
+    root = fromstring(xml)
+    introspection = {'children': [], 'interfaces': []}
+    for node in root.findall("node"):
+        introspection['children'].append(node.get("name"))
+    for interface in root.findall("interface"):
+        methods = []
+        for method in interface.findall("method"):
+            signature = ""
+            nArgs = 0
+            for arg in method.findall("arg"):
+                if arg.get("direction", "in") == "in":
+                    signature += arg.get("type")
+                    nArgs += 1
+            methods.append([method.get("name"), nArgs, signature])
+        introspection['interfaces'].append({
+            'name': interface.get("name"),
+            'methods': methods,
+            'hasProperties': interface.find("property") is not None})
+    return introspection
 
 
 
@@ -167,9 +1297,7 @@ class ExecCode:
     def append_stmt(self, stmt) :
         self.exec_code_valid = 0
         self.line += 1
-        for x in range(0,self.indent_level):
-            self.exec_string = self.exec_string + ' '            
-        self.exec_string = self.exec_string + stmt + '\n'
+        self.exec_string += ' ' * self.indent_level + stmt + '\n'
 
     def indent(self) :
         self.indent_level = self.indent_level + self.indent_increment
@@ -358,6 +1486,7 @@ class DynDBusClass():
         if (self.signature.has_key('out') and self.signature['out'] != str()):
                 decorator += ", out_signature='" + self.signature['out'] + "'"
         decorator += ", async_callbacks=('dbus_async_cb', 'dbus_async_err_cb')"            
+        decorator += ", byte_arrays=True"
         decorator += ")"
         self.class_code.append_stmt(decorator)
         if (self.signature.has_key('name') and self.signature['name'] != str()):
@@ -395,6 +1524,330 @@ class DynDBusClass():
 
 
 
+###############################################################################
+def agentClass(className, xmlTemplate):
+    '''
+    DBus classes generated from agent XML are shared by all sessions,
+    class hash id as className#sha1(xmlTemplate). Agents keep their class
+    when it is evicted from the cache.
+    '''
+    xml = xmlTemplate
+    if isinstance(xml, unicode):
+        xml = xml.encode("utf-8")
+    id = className + "#" + hashlib.sha1(xml).hexdigest()
+    agentCls = cache.agentClasses.get(id)
+    if agentCls is None:
+        classCtx = {}
+        dynDBusClass = DynDBusClass(className, globals(), classCtx)
+        dynDBusClass.createDBusServiceFromXML(xmlTemplate)
+        dynDBusClass.declare()
+        agentCls = classCtx[className]
+        cache.agentClasses.set(id, className, agentCls)
+    return agentCls
+
+
+
+###############################################################################
+# Generic decoding of JSON args, dbus types are tagged as "dbus.Type(value)" strings
+
+patternDbus = re.compile('^dbus\.(\w+)')
+patternDbusBoolean = re.compile('^dbus.Boolean\((\w+)\)$')
+patternDbusByte    = re.compile('^dbus.Byte\((\d+)\)$')
+patternDbusInt16   = re.compile('^dbus.Int16\((\d+)\)$')
+patternDbusInt32   = re.compile('^dbus.Int32\((\d+)\)$')
+patternDbusInt64   = re.compile('^dbus.Int64\((\d+)\)$')
+patternDbusUInt16  = re.compile('^dbus.UInt16\((\d+)\)$')
+patternDbusUInt32  = re.compile('^dbus.UInt32\((\d+)\)$')
+patternDbusUInt64  = re.compile('^dbus.UInt64\((\d+)\)$')
+patternDbusDouble  = re.compile('^dbus.Double\((\d+\.\d+)\)$')
+
+dbusStringDecoders = {
+   "Boolean" : lambda x : dbus.Boolean(   patternDbusBoolean.match( x ).group( 1 ).lower() in ("yes", "true", "t", "1")),
+   "Byte"    : lambda x : dbus.Byte( int( patternDbusByte.match(    x ).group( 1 ))),
+   "Int16"   : lambda x : dbus.Int16(     patternDbusInt16.match(   x ).group( 1 )),
+   "Int32"   : lambda x : dbus.Int32(     patternDbusInt32.match(   x ).group( 1 )),
+   "Int64"   : lambda x : dbus.Int64(     patternDbusInt64.match(   x ).group( 1 )),
+   "UInt16"  : lambda x : dbus.UInt16(    patternDbusUInt16.match(  x ).group( 1 )),
+   "UInt32"  : lambda x : dbus.UInt32(    patternDbusUInt32.match(  x ).group( 1 )),
+   "UInt64"  : lambda x : dbus.UInt64(    patternDbusUInt64.match(  x ).group( 1 )),
+   "Double"  : lambda x : dbus.Double(    patternDbusDouble.match(  x ).group( 1 ))
+}
+
+def decodeArgs(args):
+    if isinstance(args, list):
+        newArgs = []
+        for arg in args:
+            newArgs.append(decodeArgs(arg))
+        return newArgs
+    elif isinstance(args, dict):
+        if len(args) == 1 and args.has_key(BYTE_ARRAY_KEY):
+            return dbus.ByteArray(base64.b64decode(args[BYTE_ARRAY_KEY]))
+        newDict = {}
+        for key, value in args.iteritems():
+            newDict[decodeArgs(key)] = decodeArgs(value)
+        return newDict
+    elif isinstance(args, basestring):
+        return decodeDbusString(args)
+    else:
+        return args
+
+def decodeDbusString(dbusString):
+    matchDbus = patternDbus.match(dbusString)
+    if not matchDbus:
+        return dbusString
+    return dbusStringDecoders[matchDbus.group(1)](dbusString)
+
+
+
+###############################################################################
+# Decoding of JSON args following a dbus signature. Signatures are compiled
+# once into a conversion plan: a list of decoders, one by complete type.
+# Callers may send their own signatures, so the compiled plans are bounded.
+
+argsDecoders = LruCache(ARGS_DECODERS_CACHE_SIZE)
+
+def argsDecoder(signature):
+    '''
+    return the cached decoder of an args list for a dbus signature
+    '''
+    decoder = argsDecoders.get(signature)
+    if decoder is None:
+        decoders = [typeDecoder(completeType) for completeType in splitSignature(signature)]
+        def decoder(args):
+            newArgs = [decode(arg) for (decode, arg) in zip(decoders, args)]
+            # let dbus report the error on extra args
+            newArgs.extend(decodeArgs(args[len(decoders):]))
+            return newArgs
+        argsDecoders.set(signature, signature, decoder)
+    return decoder
+
+
+def splitSignature(signature):
+    '''
+    split a dbus signature into its complete types
+    '''
+    completeTypes = []
+    idx = 0
+    try:
+        while idx < len(signature):
+            end = completeTypeEnd(signature, idx)
+            completeTypes.append(signature[idx:end])
+            idx = end
+    except IndexError:
+        raise Exception("Error: invalid signature: %s" % signature)
+    return completeTypes
+
+
+def completeTypeEnd(signature, idx):
+    if signature[idx] == 'a':
+        return completeTypeEnd(signature, idx + 1)
+    if signature[idx] in '({':
+        closing = {'(': ')', '{': '}'}[signature[idx]]
+        idx += 1
+        while signature[idx] != closing:
+            idx = completeTypeEnd(signature, idx)
+    return idx + 1
+
+
+basicTypes = {
+    'y': dbus.Byte,
+    'b': dbus.Boolean,
+    'n': dbus.Int16,
+    'q': dbus.UInt16,
+    'i': dbus.Int32,
+    'u': dbus.UInt32,
+    'x': dbus.Int64,
+    't': dbus.UInt64,
+    'd': dbus.Double,
+    'o': dbus.ObjectPath,
+    'g': dbus.Signature
+}
+
+# bulk conversion of homogeneous arrays, done by builtins rather than one
+# python decoder call per element. The builtins must reject tagged elements
+# such as "dbus.Int32(1)", so bool is left out: it accepts any value.
+bulkArrayTypes = {
+    'n': int,
+    'q': int,
+    'i': int,
+    'u': int,
+    'x': long,
+    't': long,
+    'd': float
+}
+
+
+def typeDecoder(completeType):
+    '''
+    return a decoder function for a dbus complete type
+    '''
+    code = completeType[0]
+    if code == 's':
+        return lambda value: value
+    if basicTypes.has_key(code):
+        dbusType = basicTypes[code]
+        def decodeBasic(value):
+            if isinstance(value, basestring) and value.startswith("dbus."):
+                return dbusType(decodeDbusString(value))
+            return dbusType(value)
+        return decodeBasic
+    if code == 'a':
+        return arrayDecoder(completeType[1:])
+    if code == '(':
+        decoders = [typeDecoder(t) for t in splitSignature(completeType[1:-1])]
+        def decodeStruct(value):
+            return dbus.Struct([decode(v) for (decode, v) in zip(decoders, value)],
+                               signature=completeType[1:-1])
+        return decodeStruct
+    # variants and unix fds are tagged like untyped args
+    return decodeArgs
+
+
+def arrayDecoder(elementType):
+    if elementType[0] == '{':
+        (keyType, valueType) = splitSignature(elementType[1:-1])
+        decodeKey = typeDecoder(keyType)
+        decodeValue = typeDecoder(valueType)
+        def decodeDict(value):
+            return dbus.Dictionary([(decodeKey(k), decodeValue(v)) for (k, v) in value.iteritems()],
+                                   signature=elementType[1:-1])
+        return decodeDict
+    decodeElement = typeDecoder(elementType)
+    def decodeArray(value):
+        return dbus.Array([decodeElement(v) for v in value], signature=elementType)
+    if elementType == 'y':
+        def decodeByteArray(value):
+            if isinstance(value, dict):
+                return dbus.ByteArray(base64.b64decode(value[BYTE_ARRAY_KEY]))
+            try:
+                return dbus.ByteArray(str(bytearray(value)))
+            except (TypeError, ValueError):
+                return decodeArray(value)
+        return decodeByteArray
+    if elementType == 's':
+        return lambda value: dbus.Array(value, signature=elementType)
+    if elementType in ['b', 'o', 'g']:
+        # kept as is unless tagged, as the element decoder does
+        plainType = {'b': bool, 'o': basestring, 'g': basestring}[elementType]
+        def decodePlainArray(value):
+            for v in value:
+                if not isinstance(v, plainType) or (plainType is basestring and v.startswith("dbus.")):
+                    return decodeArray(value)
+            return dbus.Array(value, signature=elementType)
+        return decodePlainArray
+    if bulkArrayTypes.has_key(elementType):
+        bulkType = bulkArrayTypes[elementType]
+        def decodeBulkArray(value):
+            try:
+                return dbus.Array(map(bulkType, value), signature=elementType)
+            except (TypeError, ValueError):
+                # elements tagged as "dbus.Type(value)"
+                return decodeArray(value)
+        return decodeBulkArray
+    return decodeArray
+
+
+
+###############################################################################
+# Encoding of dbus values to JSON in one pass, mapping dbus types to their
+# JSON counterparts. Byte arrays are sent as {"dbus.ByteArray": base64 string}.
+
+BYTE_ARRAY_KEY = "dbus.ByteArray"
+
+def dbusJsonDumps(value):
+    return json.dumps(dbusToJson(value))
+
+
+def dbusToJson(value):
+    encode = dbusJsonEncoders.get(type(value))
+    if encode is None:
+        return value
+    return encode(value)
+
+
+def bytesToJson(value):
+    return {BYTE_ARRAY_KEY: base64.b64encode(value)}
+
+
+def listToJson(value):
+    return [dbusToJson(v) for v in value]
+
+
+def dictToJson(value):
+    return dict([(dbusToJson(k), dbusToJson(v)) for (k, v) in value.iteritems()])
+
+
+# bulk conversion of arrays of basic types, by element signature
+bulkArrayEncoders = {
+    'b': bool,
+    'n': int,
+    'q': int,
+    'i': int,
+    'u': long,
+    'x': long,
+    't': long,
+    'd': float,
+    's': unicode,
+    'o': str,
+    'g': str
+}
+
+def arrayToJson(value):
+    if value.signature == 'y':
+        return bytesToJson(str(bytearray(value)))
+    if bulkArrayEncoders.has_key(value.signature):
+        return map(bulkArrayEncoders[value.signature], value)
+    return listToJson(value)
+
+
+dbusJsonEncoders = {
+    dbus.Boolean: bool,
+    dbus.Byte: int,
+    dbus.Int16: int,
+    dbus.UInt16: int,
+    dbus.Int32: int,
+    dbus.UInt32: long,
+    dbus.Int64: long,
+    dbus.UInt64: long,
+    # json encodes floats with repr, which is "dbus.Double(value)"
+    dbus.Double: float,
+    dbus.String: unicode,
+    dbus.UTF8String: str,
+    dbus.ObjectPath: str,
+    dbus.Signature: str,
+    dbus.ByteArray: bytesToJson,
+    dbus.Array: arrayToJson,
+    dbus.Struct: listToJson,
+    dbus.Dictionary: dictToJson,
+    tuple: listToJson,
+    list: listToJson,
+    dict: dictToJson
+}
+
+
+
+###############################################################################
+# Protocols negotiated with getVersion: "json" sends args and results as JSON
+# strings inside the transport messages, "native" as structured values that
+# the transport serializes along with the message.
+
+PROTOCOLS = ["native", "json"]
+
+PROTOCOL_ENCODERS = {
+    "json": dbusJsonDumps,
+    "native": dbusToJson
+}
+
+def loadArgs(args):
+    '''
+    arg list as sent by the client, parsed if it is a JSON string
+    '''
+    if isinstance(args, basestring):
+        return json.loads(args)
+    return args
+
+
+
 ###############################################################################
 class CloudeebusService:
     '''
@@ -405,218 +1858,597 @@ class CloudeebusService:
         self.permissions['permissions'] = permissions['permissions']
         self.permissions['authextra'] = permissions['authextra']
         self.permissions['services'] = permissions['services']
-        self.proxyObjects = {}
-        self.proxyMethods = {}
-        self.pendingCalls = []
-        self.dynDBusClasses = {} # DBus class source code generated dynamically (a list because one by classname)
+        self.pendingCalls = {} # dbus calls waiting for a reply, by call id
+        self.pendingCallId = 0
+        self.signalSubscriptions = {} # signal handler ids this session subscribed to
         self.services = {}  # DBus service created
         self.serviceAgents = {} # Instantiated DBus class previously generated dynamically, for now, one by classname
-        self.servicePendingCalls = {} # JS methods called (and waiting for a Success/error response), containing 'methodId', (successCB, errorCB)
-        self.localCtx = locals()
-        self.globalCtx = globals()
-
-        self.patternDbus        = re.compile('^dbus\.(\w+)')
-        self.patternDbusBoolean = re.compile('^dbus.Boolean\((\w+)\)$')
-        self.patternDbusByte    = re.compile('^dbus.Byte\((\d+)\)$')
-        self.patternDbusInt16   = re.compile('^dbus.Int16\((\d+)\)$')
-        self.patternDbusInt32   = re.compile('^dbus.Int32\((\d+)\)$')
-        self.patternDbusInt64   = re.compile('^dbus.Int64\((\d+)\)$')
-        self.patternDbusUInt16  = re.compile('^dbus.UInt16\((\d+)\)$')
-        self.patternDbusUInt32  = re.compile('^dbus.UInt32\((\d+)\)$')
-        self.patternDbusUInt64  = re.compile('^dbus.UInt64\((\d+)\)$')
-        self.patternDbusDouble  = re.compile('^dbus.Double\((\d+\.\d+)\)$')
+        self.servicePendingCalls = {} # JS methods called (and waiting for a Success/error response) by callIndex, containing 'methodId', 'successCB', 'errorCB', 'timeout'
+        self.servicePendingCallIndex = 0
+        self.servicePendingCounts = {} # outstanding JS method calls by methodId
+        self.serviceExpiredCalls = 0
+        self.protocol = "json"
+        self.encode = dbusJsonDumps
+        self.closed = False
+        stats.sessions.add(self)
 
     def proxyObject(self, busName, serviceName, objectName):
         '''
         object hash id as busName#serviceName#objectName
         '''
+        if not OPENDOOR:
+            # check permissions, array.index throws exception
+            self.permissions['permissions'].index(serviceName)
         id = "#".join([busName, serviceName, objectName])
-        if not self.proxyObjects.has_key(id):
-            if not OPENDOOR:
-                # check permissions, array.index throws exception
-                self.permissions['permissions'].index(serviceName)
+        proxy = cache.proxyObjects.get(id)
+        if proxy is None:
             bus = cache.dbusConnexion(busName)
-            self.proxyObjects[id] = bus.get_object(serviceName, objectName)
-        return self.proxyObjects[id]
+            proxy = bus.get_object(serviceName, objectName)
+            cache.proxyObjects.set(id, busName + "#" + serviceName, proxy)
+        return proxy
 
 
     def proxyMethod(self, busName, serviceName, objectName, interfaceName, methodName):
         '''
         method hash id as busName#serviceName#objectName#interfaceName#methodName
         '''
+        if not OPENDOOR:
+            # check permissions, array.index throws exception
+            self.permissions['permissions'].index(serviceName)
         id = "#".join([busName, serviceName, objectName, interfaceName, methodName])
-        if not self.proxyMethods.has_key(id):
+        method = cache.proxyMethods.get(id)
+        if method is None:
             obj = self.proxyObject(busName, serviceName, objectName)
-            self.proxyMethods[id] = obj.get_dbus_method(methodName, interfaceName)
-        return self.proxyMethods[id]
-
-    def decodeArgs( self, args ):
-        if isinstance( args, list ):
-            newArgs = []
-            for arg in args:
-                newArgs.append( self.decodeArgs( arg ))
-            return newArgs
-        elif isinstance( args, dict ):
-            newDict = {}
-            for key, value in args.iteritems():
-                key = self.decodeArgs( key )
-                newValue = self.decodeArgs( value )
-                newDict[key] = newValue
-            return newDict
-        elif isinstance( args, basestring ):
-            newArg = self.decodeDbusString( args )
-            return newArg
-        else:
-            return args
-
-    def decodeDbusString( self, dbusString ):
-        matchDbus = self.patternDbus.match( dbusString )
-
-        if not matchDbus:
-            return dbusString
-
+            method = obj.get_dbus_method(methodName, interfaceName)
+            cache.proxyMethods.set(id, busName + "#" + serviceName, method)
+        return method
 
-        result = {
-           "Boolean" : lambda x : dbus.Boolean(   self.patternDbusBoolean.match( x ).group( 1 ).lower() in ("yes", "true", "t", "1")),
-           "Byte"    : lambda x : dbus.Byte( int( self.patternDbusByte.match(    x ).group( 1 ))),
-           "Int16"   : lambda x : dbus.Int16(     self.patternDbusInt16.match(   x ).group( 1 )),
-           "Int32"   : lambda x : dbus.Int32(     self.patternDbusInt32.match(   x ).group( 1 )),
-           "Int64"   : lambda x : dbus.Int64(     self.patternDbusInt64.match(    x ).group( 1 )),
-           "UInt16"  : lambda x : dbus.UInt16(    self.patternDbusUInt16.match(  x ).group( 1 )),
-           "UInt32"  : lambda x : dbus.UInt32(    self.patternDbusUInt32.match(  x ).group( 1 )),
-           "UInt64"  : lambda x : dbus.UInt64(    self.patternDbusUInt64.match(   x ).group( 1 )),
-           "Double"  : lambda x : dbus.Double(    self.patternDbusDouble.match(  x ).group( 1 ))
-        }[matchDbus.group(1)](dbusString)
 
-        return result
+    def proxyMethodSignature(self, busName, serviceName, objectName, interfaceName, methodName, signature=None):
+        '''
+        in signature of a proxy method, as given by the caller or found in
+        cached introspection data, None if unknown. Signatures given by the
+        caller apply to its call only, the cache is shared by all sessions.
+        '''
+        if signature is not None:
+            return signature
+        id = "#".join([busName, serviceName, objectName, interfaceName, methodName])
+        group = busName + "#" + serviceName
+        signature = cache.proxyMethodSignatures.get(id)
+        if signature is None:
+            introspection = cache.introspection(busName, serviceName, objectName)
+            if introspection is not None:
+                for interface in introspection['interfaces']:
+                    if interface['name'] != interfaceName:
+                        continue
+                    for method in interface['methods']:
+                        if method[0] == methodName:
+                            signature = method[2]
+                            cache.proxyMethodSignatures.set(id, group, signature)
+        return signature
+
+    def decodeArgs(self, args, signature=None):
+        '''
+        convert JSON args to dbus types, following the signature if known
+        '''
+        if signature is None:
+            return decodeArgs(args)
+        return argsDecoder(signature)(args)
 
     @exportRpc
+    @timedRpc
     def dbusRegister(self, list):
         '''
-        arguments: bus, sender, object, interface, signal
+        arguments: bus, sender, object, interface, signal, [options]
+        options: {"policy": "latest" | "batch", "interval": ms,
+                  "match": {"argN" | "argNpath": value}, "subtree": true}
         '''
         if len(list) < 5:
-            raise Exception("Error: expected arguments: bus, sender, object, interface, signal)")
+            raise Exception("Error: expected arguments: bus, sender, object, interface, signal, [options])")
         
         if not OPENDOOR:
             # check permissions, array.index throws exception
             self.permissions['permissions'].index(list[1])
         
-        # check if a handler exists
-        sigId = "#".join(list)
-        if cache.signalHandlers.has_key(sigId):
-            return sigId
+        options = None
+        if len(list) > 5:
+            options = list[5]
         
-        # create a handler that will publish the signal
-        dbusSignalHandler = DbusSignalHandler(*list)
-        cache.signalHandlers[sigId] = dbusSignalHandler
+        # check if a handler exists
+        sigId = signalId(list[0:5], options, self.protocol)
+        handler = cache.signalHandlers.get(sigId)
+        if handler is None:
+            # create a handler that will publish the signal
+            handler = SignalHandler(*list[0:5], options=options, protocol=self.protocol)
+            cache.signalHandlers[sigId] = handler
         
-        return dbusSignalHandler.id
+        self.subscribeSignal(sigId)
+        # handlers relaying signals of another process confirm their registration
+        if hasattr(handler, "ready"):
+            request = handler.ready()
+            request.addCallbacks(lambda result: sigId, self.registerFailed, errbackArgs=(sigId,))
+            return request
+        return sigId
+
+
+    def registerFailed(self, failure, sigId):
+        # failed handlers are already out of the cache
+        self.signalSubscriptions.pop(sigId, None)
+        return failure
 
 
     @exportRpc
+    def dbusUnregister(self, list):
+        '''
+        arguments: signal handler id, as returned by dbusRegister or propertiesWatch
+        '''
+        sigId = list[0]
+        if not self.signalSubscriptions.has_key(sigId):
+            raise Exception("Error: not registered: " + sigId)
+        del self.signalSubscriptions[sigId]
+        cache.releaseSignalHandler(sigId)
+        return sigId
+
+
+    def subscribeSignal(self, sigId):
+        '''
+        signal handlers are counted once per session
+        '''
+        if not self.signalSubscriptions.has_key(sigId):
+            cache.acquireSignalHandler(sigId)
+            self.signalSubscriptions[sigId] = True
+
+
+    @exportRpc
+    @timedRpc
     def dbusSend(self, list):
         '''
-        arguments: bus, destination, object, interface, message, [args]
+        arguments: bus, destination, object, interface, message, [args, [signature, [timeout]]]
+        timeout in ms, dbus default if none
+        '''
+        return self.sendMessage(list)
+
+
+    def sendMessage(self, list):
+        '''
+        dbusSend without RPC metrics, also used for dbusSendBatch entries
         '''
-        # clear pending calls
-        for call in self.pendingCalls:
-            if not call.pending:
-                self.pendingCalls.remove(call)
-        
         if len(list) < 5:
-            raise Exception("Error: expected arguments: bus, destination, object, interface, message, [args])")
-        
-        # parse JSON arg list
-        args = []
-        if len(list) == 6:
-            jsonArgs = json.loads(list[5])
-            if jsonArgs:
-                args = self.decodeArgs( jsonArgs )
+            raise Exception("Error: expected arguments: bus, destination, object, interface, message, [args, [signature, [timeout]]])")
         
         # get dbus proxy method
         method = self.proxyMethod(*list[0:5])
+        signature = None
+        if len(list) > 6:
+            signature = list[6]
+        signature = self.proxyMethodSignature(*list[0:5], signature=signature)
         
-        # use a deferred call handler to manage dbus results
-        dbusCallHandler = DbusCallHandler(method, args)
-        self.pendingCalls.append(dbusCallHandler)
-        return dbusCallHandler.callMethod()
+        timeout = None
+        if len(list) > 7 and list[7] is not None:
+            timeout = list[7] / 1000.0
+        
+        if len(list) <= 5:
+            return self.callMethod([], method, signature, timeout, list[1])
+        if offloaded(payloadSize(list[5])):
+            # parse large arg lists in a thread, the call is made from the reactor
+            request = deferToThread(self.loadArgs, list[5], signature)
+            request.addCallback(self.callMethod, method, signature, timeout, list[1])
+            return request
+        return self.callMethod(self.loadArgs(list[5], signature), method, signature, timeout, list[1])
+
+
+    def loadArgs(self, args, signature=None):
+        '''
+        parse arg list as sent by the client and convert it to dbus types
+        '''
+        args = loadArgs(args)
+        if not args:
+            return []
+        return self.decodeArgs(args, signature)
+
+
+    def callMethod(self, args, method, signature, timeout, destination):
+        '''
+        use a deferred call handler to manage dbus results
+        '''
+        # args decoded in a thread may be ready after the session is closed
+        if self.closed:
+            raise Exception("Error: call cancelled")
+        dbusCallHandler = DbusCallHandler(method, args, signature, timeout, self.encode, destination)
+        self.pendingCallId += 1
+        return dbusCallHandler.callMethod(self.pendingCalls, self.pendingCallId)
+
+
+    def close(self):
+        '''
+        cancel calls in progress, release signal handlers and answer pending
+        agent method calls when the session is closed
+        '''
+        self.closed = True
+        for call in self.pendingCalls.values():
+            call.cancel()
+        for sigId in self.signalSubscriptions:
+            cache.releaseSignalHandler(sigId)
+        self.signalSubscriptions = {}
+        for callIndex in self.servicePendingCalls.keys():
+            cb = self.servicePendingCallDone(callIndex)
+            cb['errorCB'](dbus.DBusException("Agent session closed: " + cb['methodId'],
+                                             name="org.freedesktop.DBus.Error.NoReply"))
 
 
     @exportRpc
+    def dbusIntrospect(self, list):
+        '''
+        arguments: bus, destination, object
+        return: JSON description of child nodes and interfaces with their
+        methods and property values
+        '''
+        if len(list) < 3:
+            raise Exception("Error: expected arguments: bus, destination, object)")
+        
+        if not OPENDOOR:
+            # check permissions, array.index throws exception
+            self.permissions['permissions'].index(list[1])
+        
+        request = self.introspectObject(list[0:3])
+        request.addCallback(lambda introspection: self.introspectProperties(list[0:3], introspection))
+        return request
+
+
+    def introspectObject(self, objectId):
+        '''
+        deferred introspection data of an object, from the cache or the object
+        '''
+        introspection = cache.introspection(*objectId)
+        if introspection is not None:
+            return defer.succeed(introspection)
+        method = self.proxyMethod(objectId[0], objectId[1], objectId[2], "org.freedesktop.DBus.Introspectable", "Introspect")
+        request = dbusCall(method, [])
+        request.addCallback(self.introspectSuccess, objectId)
+        return request
+
+
+    def introspectSuccess(self, result, objectId):
+        introspection = parseIntrospection(result[0])
+        cache.setIntrospection(objectId[0], objectId[1], objectId[2], introspection)
+        return introspection
+
+
+    def introspectProperties(self, objectId, introspection):
+        '''
+        get properties of all the interfaces concurrently
+        '''
+        propInterfaces = []
+        supportDBusProperties = False
+        for interface in introspection['interfaces']:
+            if interface['name'] == "org.freedesktop.DBus.Properties":
+                supportDBusProperties = True
+            if interface['hasProperties']:
+                propInterfaces.append(interface['name'])
+        if not supportDBusProperties:
+            propInterfaces = []
+        
+        requests = []
+        if propInterfaces:
+            method = self.proxyMethod(objectId[0], objectId[1], objectId[2], "org.freedesktop.DBus.Properties", "GetAll")
+            for ifName in propInterfaces:
+                requests.append(dbusCall(method, [ifName]))
+        
+        def getAllDone(results):
+            properties = {}
+            for idx in range(len(propInterfaces)):
+                # interfaces failing to return their properties have none
+                (success, result) = results[idx]
+                if success:
+                    properties[propInterfaces[idx]] = result[0]
+            description = {'children': introspection['children'], 'interfaces': []}
+            for interface in introspection['interfaces']:
+                description['interfaces'].append({
+                    'name': interface['name'],
+                    'methods': interface['methods'],
+                    'properties': properties.get(interface['name'], {})})
+            return self.encode(description)
+        
+        request = defer.DeferredList(requests, consumeErrors=True)
+        request.addCallback(getAllDone)
+        return request
+
+
+    @exportRpc
+    def propertiesWatch(self, list):
+        '''
+        arguments: bus, destination, object, interface
+        return: JSON [mirror id, properties], deltas are published under mirror id
+        '''
+        if len(list) < 4:
+            raise Exception("Error: expected arguments: bus, destination, object, interface)")
+        
+        mirror = self.propertyMirror(list[0:4], True)
+        self.subscribeSignal(mirror.id)
+        request = mirror.ready()
+        request.addCallback(lambda properties: self.encode([mirror.id, properties]))
+        return request
+
+
+    @exportRpc
+    def propertiesGet(self, list):
+        '''
+        arguments: bus, destination, object, interface, [property]
+        return: JSON property value, or all properties, read from the mirror
+        '''
+        if len(list) < 4:
+            raise Exception("Error: expected arguments: bus, destination, object, interface, [property])")
+        
+        mirror = self.propertyMirror(list[0:4], False)
+        if mirror is None:
+            raise Exception("Error: properties not watched: " + "#".join(list[0:4]))
+        request = mirror.ready()
+        if len(list) == 4:
+            request.addCallback(lambda properties: self.encode([properties]))
+            return request
+        
+        name = list[4]
+        def getProperty(properties):
+            if properties.has_key(name):
+                return self.encode([properties[name]])
+            # invalidated properties are not sent with PropertiesChanged
+            method = self.proxyMethod(list[0], list[1], list[2], "org.freedesktop.DBus.Properties", "Get")
+            return dbusCall(method, [list[3], name]).addCallback(self.encode)
+        request.addCallback(getProperty)
+        return request
+
+
+    def propertyMirror(self, objectId, create):
+        '''
+        mirrors are shared with signal handlers
+        '''
+        if not OPENDOOR:
+            # check permissions, array.index throws exception
+            self.permissions['permissions'].index(objectId[1])
+        
+        mirrorId = protocolId("#".join(objectId + ["PropertiesChanged", "mirror"]), self.protocol)
+        refCount = 0
+        if cache.signalHandlers.has_key(mirrorId):
+            mirror = cache.signalHandlers[mirrorId]
+            # retry seeding mirrors that failed
+            if mirror.failure is None or not create:
+                return mirror
+            mirror.disconnect()
+            refCount = mirror.refCount
+        if not create:
+            return None
+        
+        getAll = self.proxyMethod(objectId[0], objectId[1], objectId[2], "org.freedesktop.DBus.Properties", "GetAll")
+        mirror = DbusPropertyMirror(objectId[0], objectId[1], objectId[2], objectId[3], getAll, self.protocol)
+        mirror.refCount = refCount
+        cache.signalHandlers[mirrorId] = mirror
+        return mirror
+
+
+    @exportRpc
+    @timedRpc
+    def getManagedObjects(self, list):
+        '''
+        arguments: bus, destination, object manager
+        return: JSON [mirror id, objects, interfaces] with objects as
+        {path: {interface: properties}} and interfaces as {interface: methods},
+        deltas are published under mirror id
+        '''
+        if len(list) < 3:
+            raise Exception("Error: expected arguments: bus, destination, object manager)")
+        
+        mirror = self.objectManagerMirror(list[0:3])
+        self.subscribeSignal(mirror.id)
+        
+        def describe(objects):
+            request = self.interfaceMethods(list[0], list[1], objects)
+            request.addCallback(lambda interfaces: self.encode([mirror.id, objects, interfaces]))
+            return request
+        
+        request = mirror.ready()
+        request.addCallback(describe)
+        return request
+
+
+    def interfaceMethods(self, busName, serviceName, objects):
+        '''
+        methods of the interfaces of managed objects, introspecting one object
+        per interface, concurrently
+        '''
+        paths = {}
+        for path in sorted(objects):
+            for ifName in objects[path]:
+                paths.setdefault(ifName, path)
+        paths = sorted(set(paths.values()))
+        requests = []
+        for path in paths:
+            requests.append(self.introspectObject([busName, serviceName, path]))
+        
+        def introspectDone(results):
+            # interfaces of objects failing introspection have no methods
+            interfaces = {}
+            for (success, introspection) in results:
+                if success:
+                    for interface in introspection['interfaces']:
+                        interfaces.setdefault(interface['name'], interface['methods'])
+            return interfaces
+        
+        request = defer.DeferredList(requests, consumeErrors=True)
+        request.addCallback(introspectDone)
+        return request
+
+
+    def objectManagerMirror(self, objectId):
+        '''
+        mirrors are shared with signal handlers
+        '''
+        if not OPENDOOR:
+            # check permissions, array.index throws exception
+            self.permissions['permissions'].index(objectId[1])
+        
+        mirrorId = protocolId("#".join(objectId + ["org.freedesktop.DBus.ObjectManager", "mirror"]), self.protocol)
+        refCount = 0
+        if cache.signalHandlers.has_key(mirrorId):
+            mirror = cache.signalHandlers[mirrorId]
+            # retry seeding mirrors that failed
+            if mirror.failure is None:
+                return mirror
+            mirror.disconnect()
+            refCount = mirror.refCount
+        
+        getManagedObjects = self.proxyMethod(objectId[0], objectId[1], objectId[2], "org.freedesktop.DBus.ObjectManager", "GetManagedObjects")
+        mirror = DbusObjectManagerMirror(objectId[0], objectId[1], objectId[2], getManagedObjects, self.protocol)
+        mirror.refCount = refCount
+        cache.signalHandlers[mirrorId] = mirror
+        return mirror
+
+
+    @exportRpc
+    @timedRpc
+    def dbusSendBatch(self, list):
+        '''
+        arguments: list of [bus, destination, object, interface, message, [args]]
+        return: list of [success, JSON result or error message], in call order
+        '''
+        calls = []
+        for entry in list:
+            # errors raised before the dbus call are reported per entry
+            calls.append(defer.maybeDeferred(self.sendMessage, entry))
+
+        batch = defer.DeferredList(calls, consumeErrors=True)
+        batch.addCallback(self.batchResults)
+        return batch
+
+
+    def batchResults(self, results):
+        '''
+        convert DeferredList results into [success, result or error message]
+        '''
+        replies = []
+        for (success, result) in results:
+            if success:
+                replies.append([True, result])
+            else:
+                replies.append([False, result.getErrorMessage()])
+        return replies
+
+
+    @exportRpc
+    @timedRpc
     def emitSignal(self, list):
         '''
         arguments: agentObjectPath, signalName, args (to emit)
         '''
-        objectPath = list[0]
-        className = re.sub('/', '_', objectPath[1:])
-        signalName = list[1]
+        self.emitAgentSignal(list[0], list[1], list[2])
+
+    @exportRpc
+    @timedRpc
+    def emitSignals(self, list):
+        '''
+        arguments: list of [agentObjectPath, signalName, args (to emit)]
+        return: list of [success, error message or None], in emit order
+        '''
+        replies = []
+        for signal in list:
+            try:
+                self.emitAgentSignal(signal[0], signal[1], signal[2])
+                replies.append([True, None])
+            except Exception, e:
+                replies.append([False, str(e)])
+        return replies
+
+    def emitAgentSignal(self, objectPath, signalName, jsonArgs):
+        '''
+        call the generated signal method with args decoded following its signature
+        '''
+        className = createClassName(objectPath)
+        if (self.serviceAgents.has_key(className) == False):
+            raise Exception("No object path " + objectPath)
+        signal = getattr(self.serviceAgents[className], signalName, None)
+        if not getattr(signal, "_dbus_is_signal", False):
+            raise Exception("No signal " + signalName + " on object path " + objectPath)
+        
         args = []
-        jsonArgs = json.loads(list[2])
-        print "JSON Arguments:", jsonArgs
+        jsonArgs = loadArgs(jsonArgs)
         if jsonArgs:
-            args = self.decodeArgs( jsonArgs )
-            print "Decoded Arguments: ", args
-
-        if (self.serviceAgents.has_key(className) == True):            
-            exe_str = "self.serviceAgents['"+ className +"']."+ signalName + "("
-            if len(args) > 0:
-                exe_str += json.dumps(args[0])
-                for idx in args[1:]:
-                    exe_str += "," + json.dumps(idx)
-            exe_str += ")"               
-            eval(exe_str, self.globalCtx, self.localCtx)
-        else:
-            raise Exception("No object path " + objectPath)
+            args = self.decodeArgs(jsonArgs, signal._dbus_signature)
+        signal(*args)
 
     @exportRpc
+    @timedRpc
     def returnMethod(self, list):
         '''
         arguments: methodId, callIndex, success (=true, error otherwise), result (to return)
+        results are sent as a one element args list, errors as a message
         '''
         methodId = list[0]
         callIndex = list[1]
         success = list[2]
         result = list[3]
-        if (self.servicePendingCalls.has_key(methodId)):
-            cb = self.servicePendingCalls[methodId]['calls'][callIndex]
-            if cb is None:
-                raise Exception("No pending call " + str(callIndex) + " for methodID " + methodId)
-            if (success):                
-                successCB = cb["successCB"]
-                if (result != None):
-                    successCB(result)
-                else:
-                    successCB()                    
-            else:     
-                errorCB = cb["errorCB"]        
-                if (result != None):
-                    errorCB(result)
-                else:
-                    errorCB()
-            self.servicePendingCalls[methodId]['calls'][callIndex] = None
-            self.servicePendingCalls[methodId]['count'] = self.servicePendingCalls[methodId]['count'] - 1
-            if self.servicePendingCalls[methodId]['count'] == 0:
-                del self.servicePendingCalls[methodId]
-        else:
-            raise Exception("No methodID " + methodId)
+        cb = self.servicePendingCalls.get(callIndex)
+        if cb is None or cb['methodId'] != methodId:
+            raise Exception("No pending call " + str(callIndex) + " for methodID " + methodId)
+        self.servicePendingCallDone(callIndex)
+        if (success):                
+            successCB = cb["successCB"]
+            successCB(*self.decodeResult(methodId, result))
+        else:     
+            errorCB = cb["errorCB"]        
+            if (result != None):
+                errorCB(result)
+            else:
+                errorCB()
+
+    def decodeResult(self, methodId, result):
+        '''
+        convert an agent method result to dbus types following the method out
+        signature, methods with several out args return them as a list
+        '''
+        result = loadArgs(result)[0]
+        if result is None:
+            return []
+        (srvName, objPath, ifName, name) = methodId.split("#")
+        method = getattr(self.serviceAgents.get(createClassName(objPath)), name, None)
+        signature = getattr(method, "_dbus_out_signature", None)
+        if not signature:
+            return self.decodeArgs([result])
+        if len(splitSignature(signature)) > 1:
+            return self.decodeArgs(result, signature)
+        return self.decodeArgs([result], signature)
 
     def srvCB(self, srvName, name, objPath, ifName, async_succes_cb, async_error_cb, *args):
         methodId = srvName + "#" + objPath + "#" + ifName + "#" + name
-        cb = { 'successCB': async_succes_cb, 
-               'errorCB': async_error_cb}
-        if methodId not in self.servicePendingCalls:
-            self.servicePendingCalls[methodId] = {'count': 0, 'calls': []}
-            
-        try:
-            pendingCallStr = json.dumps({'callIndex': len(self.servicePendingCalls[methodId]['calls']), 'args': args})
-        except Exception, e:                
-            args = eval( str(args).replace("dbus.Byte", "dbus.Int16") )
-            pendingCallStr = json.dumps({'callIndex': len(self.servicePendingCalls[methodId]['calls']), 'args': args})
-               
-        self.servicePendingCalls[methodId]['calls'].append(cb)
-        self.servicePendingCalls[methodId]['count'] = self.servicePendingCalls[methodId]['count'] + 1
-        factory.dispatch(methodId, pendingCallStr)
+        self.servicePendingCallIndex += 1
+        callIndex = self.servicePendingCallIndex
+        pendingCall = self.encode({'callIndex': callIndex, 'args': args})
+        self.servicePendingCalls[callIndex] = {
+            'methodId': methodId,
+            'successCB': async_succes_cb,
+            'errorCB': async_error_cb,
+            'timeout': callLater(AGENT_CALL_TIMEOUT, self.servicePendingCallExpired, callIndex)}
+        self.servicePendingCounts[methodId] = self.servicePendingCounts.get(methodId, 0) + 1
+        factory.dispatch(methodId, pendingCall)
+
+    def servicePendingCallDone(self, callIndex):
+        cb = self.servicePendingCalls.pop(callIndex)
+        if cb['timeout'].active():
+            cb['timeout'].cancel()
+        count = self.servicePendingCounts[cb['methodId']] - 1
+        if count == 0:
+            del self.servicePendingCounts[cb['methodId']]
+        else:
+            self.servicePendingCounts[cb['methodId']] = count
+        return cb
+
+    def servicePendingCallExpired(self, callIndex):
+        '''
+        answer dbus callers when JS does not
+        '''
+        cb = self.servicePendingCallDone(callIndex)
+        self.serviceExpiredCalls += 1
+        stats.agentCallsExpired += 1
+        cb['errorCB'](dbus.DBusException("No reply from agent method " + cb['methodId'],
+                                         name="org.freedesktop.DBus.Error.NoReply"))
                     
     @exportRpc
     def serviceAdd(self, list):
@@ -654,14 +2486,11 @@ class CloudeebusService:
         agentObjectPath = list[1]
         xmlTemplate = list[2]
         className = createClassName(agentObjectPath)
-        if (self.dynDBusClasses.has_key(className) == False):
-            self.dynDBusClasses[className] = DynDBusClass(className, self.globalCtx, self.localCtx)
-            self.dynDBusClasses[className].createDBusServiceFromXML(xmlTemplate)
-            self.dynDBusClasses[className].declare()
 
-        ## Class already exist, instanciate it if not already instanciated
+        ## Instanciate the class if not already instanciated
         if (self.serviceAgents.has_key(className) == False):
-            self.serviceAgents[className] = eval(className + "(self.bus, callback=self.srvCB, objPath='" + agentObjectPath + "', srvName='" + srvName + "')", self.globalCtx, self.localCtx)
+            agentCls = agentClass(className, xmlTemplate)
+            self.serviceAgents[className] = agentCls(self.bus, callback=self.srvCB, objPath=agentObjectPath, srvName=srvName)
             
         self.serviceAgents[className].add_to_connection()
         return (agentObjectPath)
@@ -683,8 +2512,30 @@ class CloudeebusService:
         return (agentObjectPath)
                     
     @exportRpc
-    def getVersion(self):
+    def getStats(self, list=None):
+        '''
+        arguments: none
+        return: engine metrics, needs the org.cloudeebus.Stats permission
+        '''
+        if not OPENDOOR:
+            # check permissions, array.index throws exception
+            self.permissions['permissions'].index(STATS_PERMISSION)
+        return stats.snapshot()
+
+    @exportRpc
+    def getVersion(self, list=None):
         '''
-        return current version string
+        arguments: none, or client version, list of protocols by preference
+        return: current version string, or [version, protocol] where protocol
+        is the first client protocol supported, "json" otherwise
         '''
-        return VERSION
+        if list is None:
+            return VERSION
+        self.protocol = "json"
+        if len(list) > 1:
+            for protocol in list[1]:
+                if protocol in PROTOCOLS:
+                    self.protocol = str(protocol)
+                    break
+        self.encode = PROTOCOL_ENCODERS[self.protocol]
+        return [VERSION, self.protocol]
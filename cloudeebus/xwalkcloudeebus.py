@@ -45,6 +45,10 @@
 # [ "signal", <topic>, [<parameters>] ]
 # [ "subscribe", <topic> ]
 # [ "unsubscribe", <topic> ]
+# [ "batch", [<message>, ...] ]
+#
+# Messages posted during one main loop iteration are sent together as
+# a batch, in both directions.
 
 import gi.repository
 import sys
@@ -62,8 +66,10 @@ DBusGMainLoop(set_as_default=True)
 
 from twisted.internet import defer
 from twisted.python import log
-# enable debug log
-#log.startLogging(sys.stdout)
+# enable debug log with CLOUDEEBUS_DEBUG=1
+DEBUG = os.environ.get('CLOUDEEBUS_DEBUG', False)
+if DEBUG:
+  log.startLogging(sys.stdout)
 
 import xwalk
 
@@ -76,52 +82,123 @@ cloudeebusengine.OPENDOOR = True # No other process has access, so we need no ad
 class Factory:
   # Mapping from instance ID to hash with all subscribed topics.
   instances = {}
+  # Reverse mapping from topic to the set of subscribed instance IDs.
+  topics = {}
   def dispatch(self, topic, event):
-    for instance, topics in Factory.instances.iteritems():
-      if topic in topics:
-        xwalk.PostMessage(instance, json.dumps(['signal', topic, event]))
+    subscribers = Factory.topics.get(topic)
+    if not subscribers:
+      return
+    # serialize the envelope once for all the subscribers
+    message = json.dumps(['signal', topic, event])
+    for instance in subscribers:
+      PostEnvelope(instance, message)
+
+  @staticmethod
+  def subscribe(instance, topic):
+    Factory.instances[instance][topic] = True
+    Factory.topics.setdefault(topic, set()).add(instance)
+
+  @staticmethod
+  def unsubscribe(instance, topic):
+    del Factory.instances[instance][topic]
+    subscribers = Factory.topics[topic]
+    subscribers.discard(instance)
+    if not subscribers:
+      del Factory.topics[topic]
+
+  @staticmethod
+  def removeInstance(instance):
+    for topic in Factory.instances[instance].keys():
+      Factory.unsubscribe(instance, topic)
+    del Factory.instances[instance]
 
 cloudeebusengine.factory = Factory()
 
-service = cloudeebusengine.CloudeebusService({'permissions': [], 'authextra': '', 'services': []})
+# One service per instance, like one per WAMP session.
+services = {}
 methods = {}
 
-for method in inspect.getmembers(service.__class__, inspect.ismethod):
+for method in inspect.getmembers(cloudeebusengine.CloudeebusService, inspect.ismethod):
   if method[1].__dict__.has_key("_xwalk_rpc_id"):
     name = method[1].__dict__["_xwalk_rpc_id"]
     proc = method[1]
     methods[name] = proc
 
+# Serialized messages waiting to be posted, by instance ID.
+outbound = {}
+
+def PostEnvelope(instance, envelope):
+  if not outbound:
+    # default priority like the dbus watches, an idle priority source would
+    # starve under a steady signal load
+    GLib.idle_add(FlushEnvelopes, priority=GLib.PRIORITY_DEFAULT)
+  outbound.setdefault(instance, []).append(envelope)
+
+def FlushEnvelopes():
+  queues = outbound.items()
+  outbound.clear()
+  for instance, queue in queues:
+    if len(queue) == 1:
+      xwalk.PostMessage(instance, queue[0])
+    else:
+      # envelopes are already serialized, join them into a batch message
+      xwalk.PostMessage(instance, '["batch", [' + ', '.join(queue) + ']]')
+  return False
+
+def CallDone(instance, sequencenr, result):
+  if DEBUG:
+    log.msg('call %d done: %s' % (sequencenr, result))
+  PostEnvelope(instance, json.dumps(['reply', sequencenr, '', result]))
+
+def CallFailed(instance, sequencenr, error):
+  if DEBUG:
+    log.msg('call %d failed: %s' % (sequencenr, error))
+  PostEnvelope(instance, json.dumps(['reply', sequencenr, str(error), []]))
+
 def HandleMessage(instance, message):
-  log.msg('New message: %s' % message)
+  if DEBUG:
+    log.msg('New message: %s' % message)
   content = json.loads(message)
+  if content[0] == 'batch':
+    for envelope in content[1]:
+      HandleEnvelope(instance, envelope)
+  else:
+    HandleEnvelope(instance, content)
+
+def HandleEnvelope(instance, content):
   msgtype = content[0]
   if msgtype == 'call':
     sequencenr = content[1]
     try:
       name = str(content[2])
       params = content[3]
-      d = defer.maybeDeferred(methods[name], service, params)
-      d.addCallback(lambda result: (log.msg('call %d done: %s' % (sequencenr, result)), xwalk.PostMessage(instance, json.dumps(['reply', sequencenr, '', result]))))
-      d.addErrback(lambda error: (log.msg('call %d failed: %s' % (sequencenr, error)), xwalk.PostMessage(instance, json.dumps(['reply', sequencenr, str(error), []]))))
+      d = defer.maybeDeferred(methods[name], services[instance], params)
+      d.addCallbacks(lambda result: CallDone(instance, sequencenr, result),
+                     lambda error: CallFailed(instance, sequencenr, error))
     except Exception, ex:
       log.msg('failed to start call %d: %s' % (sequencenr, traceback.format_exc()));
-      xwalk.PostMessage(instance, json.dumps(['reply', sequencenr, repr(ex), []]))
+      PostEnvelope(instance, json.dumps(['reply', sequencenr, repr(ex), []]))
   elif msgtype == 'subscribe':
     topic = content[1]
-    log.msg('Subscribing %d to %s' % (instance, topic))
-    Factory.instances[instance][topic] = True
+    if DEBUG:
+      log.msg('Subscribing %d to %s' % (instance, topic))
+    Factory.subscribe(instance, topic)
   elif msgtype == 'unsubscribe':
     topic = content[1]
-    log.msg('Unsubscribing %d from %s' % (instance, topic))
-    del Factory.instances[instance][topic]
+    if DEBUG:
+      log.msg('Unsubscribing %d from %s' % (instance, topic))
+    Factory.unsubscribe(instance, topic)
 
 def HandleInstanceCreated(instance):
   Factory.instances[instance] = {}
+  services[instance] = cloudeebusengine.CloudeebusService({'permissions': [], 'authextra': '', 'services': []})
   xwalk.SetMessageCallback(instance, HandleMessage)
 
 def HandleInstanceDestroyed(instance):
-  del Factory.instances[instance]
+  Factory.removeInstance(instance)
+  outbound.pop(instance, None)
+  # cancel calls and release signal handlers of the instance
+  services.pop(instance).close()
 
 def Main():
   xwalk.SetExtensionName("cloudeebus")
@@ -164,8 +241,7 @@ def Main():
       return this;
     };
 
-    extension.setMessageListener(function(msg) {
-      var msg_content = JSON.parse(msg);
+    var handleMessage = function(msg_content) {
       if (msg_content[0] == "reply") {
         // Handle message reply.
         var pending = pending_calls[msg_content[1]];
@@ -189,8 +265,31 @@ def Main():
           handler(topic, args);
         }
       }
+    };
+
+    extension.setMessageListener(function(msg) {
+      var msg_content = JSON.parse(msg);
+      if (msg_content[0] == "batch") {
+        for (var i = 0; i < msg_content[1].length; i++)
+          handleMessage(msg_content[1][i]);
+      } else {
+        handleMessage(msg_content);
+      }
     });
 
+    // Messages posted until the next task are sent together as a batch.
+    var outbound = [];
+    var flush = function() {
+      var message = outbound.length == 1 ? outbound[0] : [ "batch", outbound ];
+      outbound = [];
+      extension.postMessage(JSON.stringify(message));
+    };
+    var post = function(message) {
+      if (outbound.length == 0)
+        setTimeout(flush, 0);
+      outbound.push(message);
+    };
+
     // Emulate WAMPSession.
     var Session = function() {
       this.extension = extension;
@@ -198,23 +297,20 @@ def Main():
     };
     Session.prototype.call = function(method, args) {
       var message = [ "call", call_counter, method, args ];
-      var data = JSON.stringify(message);
       var pending = new Pending();
       pending_calls[call_counter] = pending;
-      this.extension.postMessage(data);
+      post(message);
       call_counter++;
       return pending;
     };
     Session.prototype.subscribe = function(topic, handler) {
       var message = [ "subscribe", topic ]
-      var data = JSON.stringify(message);
-      this.extension.postMessage(data);
+      post(message);
       topics[topic] = handler;
     }
     Session.prototype.unsubscribe = function(topic) {
       var message = [ "unsubscribe", topic ]
-      var data = JSON.stringify(message);
-      this.extension.postMessage(data);
+      post(message);
       delete topics[topic];
     }
     var session = new Session();
@@ -223,7 +319,12 @@ def Main():
       cloudeebus.reset();
       cloudeebus.sessionBus = new cloudeebus.BusConnection("session", session);
       cloudeebus.systemBus = new cloudeebus.BusConnection("system", session);
-      successCB();
+      // select the protocol, native values need no JSON strings in messages
+      session.call("getVersion", [cloudeebus.version, cloudeebus.protocols]).then(function(reply) {
+        cloudeebus.protocol = reply[1];
+        if (successCB)
+          successCB();
+      }, errorCB);
     };
     exports.SessionBus = cloudeebus.SessionBus;
     exports.SystemBus = cloudeebus.SystemBus;
@@ -16,24 +16,17 @@
 
 
 
-/*****************************************************************************/
-
-var dbus = { // hook object for dbus types not translated by python-json
-		Double: function(value, level) {
-			return value;
-		}
-};
-
-
-
 /*****************************************************************************/
 
 var cloudeebus = window.cloudeebus = {
-		version: "0.6.1",
-		minVersion: "0.6.0"
+		version: "0.7.0",
+		minVersion: "0.7.0",
+		protocols: ["native", "json"], // by preference
+		protocol: "json"
 };
 
 cloudeebus.reset = function() {
+	cloudeebus.protocol = "json";
 	cloudeebus.sessionBus = null;
 	cloudeebus.systemBus = null;
 	cloudeebus.wampSession = null;
@@ -60,6 +53,84 @@ cloudeebus.getError = function(error) {
 	return error; // Autobahn error
 };
 
+cloudeebus.BYTE_ARRAY_KEY = "dbus.ByteArray";
+
+
+cloudeebus.parseJSON = function(str) {
+	// byte arrays are encoded as {"dbus.ByteArray": base64 string}
+	var value = JSON.parse(str);
+	if (str.indexOf('"' + cloudeebus.BYTE_ARRAY_KEY + '"') != -1)
+		value = cloudeebus._decodeByteArrays(value);
+	return value;
+};
+
+
+cloudeebus._decodeByteArrays = function(value) {
+	if (value == null || typeof value != "object")
+		return value;
+	var base64 = value[cloudeebus.BYTE_ARRAY_KEY];
+	if (typeof base64 == "string") {
+		var str = atob(base64);
+		var bytes = new Uint8Array(str.length);
+		for (var i=0; i < str.length; i++)
+			bytes[i] = str.charCodeAt(i);
+		return bytes;
+	}
+	for (var key in value)
+		value[key] = cloudeebus._decodeByteArrays(value[key]);
+	return value;
+};
+
+
+cloudeebus.stringifyJSON = function(value) {
+	// Uint8Array values are encoded as {"dbus.ByteArray": base64 string}
+	return JSON.stringify(value, function(key, val) {
+		if (val instanceof Uint8Array)
+			return cloudeebus._encodeByteArray(val);
+		return val;
+	});
+};
+
+
+cloudeebus._encodeByteArray = function(bytes) {
+	var str = "";
+	var chunk = 0x8000;
+	for (var i=0; i < bytes.length; i += chunk)
+		str += String.fromCharCode.apply(null, bytes.subarray(i, i + chunk));
+	var encoded = {};
+	encoded[cloudeebus.BYTE_ARRAY_KEY] = btoa(str);
+	return encoded;
+};
+
+
+cloudeebus._encodeByteArrays = function(value) {
+	if (value == null || typeof value != "object")
+		return value;
+	if (value instanceof Uint8Array)
+		return cloudeebus._encodeByteArray(value);
+	var encoded = (value instanceof Array) ? [] : {};
+	for (var key in value)
+		encoded[key] = cloudeebus._encodeByteArrays(value[key]);
+	return encoded;
+};
+
+
+cloudeebus.encode = function(value) {
+	// args are sent as a JSON string, or as values with the native protocol
+	if (cloudeebus.protocol == "json")
+		return cloudeebus.stringifyJSON(value);
+	return cloudeebus._encodeByteArrays(value);
+};
+
+
+cloudeebus.decode = function(data) {
+	// results are received as a JSON string, or as values with the native protocol
+	if (typeof data == "string")
+		return cloudeebus.parseJSON(data);
+	return cloudeebus._decodeByteArrays(data);
+};
+
+
 cloudeebus.versionCheck = function(version) {
 	var ver = version.split(".");
 	var min = cloudeebus.minVersion.split(".");
@@ -77,7 +148,13 @@ cloudeebus.connect = function(uri, manifest, successCB, errorCB) {
 	cloudeebus.reset();
 	cloudeebus.uri = uri;
 	
-	function onCloudeebusVersionCheckCB(version) {
+	function onCloudeebusVersionCheckCB(reply) {
+		// reply is [version, protocol], or the version string for older servers
+		var version = reply;
+		if (reply instanceof Array) {
+			version = reply[0];
+			cloudeebus.protocol = reply[1];
+		}
 		if (cloudeebus.versionCheck(version)) {
 			cloudeebus.log("Connected to " + cloudeebus.uri);
 			if (successCB)
@@ -100,7 +177,7 @@ cloudeebus.connect = function(uri, manifest, successCB, errorCB) {
 	function onWAMPSessionAuthenticatedCB(permissions) {
 		cloudeebus.sessionBus = new cloudeebus.BusConnection("session", cloudeebus.wampSession);
 		cloudeebus.systemBus = new cloudeebus.BusConnection("system", cloudeebus.wampSession);
-		cloudeebus.wampSession.call("getVersion").then(onCloudeebusVersionCheckCB, errorCB);
+		cloudeebus.wampSession.call("getVersion", [cloudeebus.version, cloudeebus.protocols]).then(onCloudeebusVersionCheckCB, errorCB);
 	}
 	
 	function onWAMPSessionChallengedCB(challenge) {
@@ -153,6 +230,14 @@ cloudeebus.SystemBus = function() {
 cloudeebus.BusConnection = function(name, session) {
 	this.name = name;
 	this.wampSession = session;
+	// autoBatch: send the ProxyObject.callMethod calls of a same tick as one
+	// dbusSendBatch, with at most maxOutstanding calls waiting for their
+	// reply, 0 for no limit. Calls over the limit wait for replies.
+	this.autoBatch = false;
+	this.maxOutstanding = 0;
+	this.outstandingCalls = 0;
+	this.queuedCalls = [];
+	this.flushTimer = null;
 	return this;
 };
 
@@ -165,6 +250,221 @@ cloudeebus.BusConnection.prototype.getObject = function(busName, objectPath, int
 };
 
 
+cloudeebus.BusConnection.prototype.getManagedObjects = function(busName, objectPath, successCB, errorCB, changedCB) {
+	// builds proxies of all the objects of an ObjectManager from one server
+	// side snapshot, kept up to date. Returns the manager proxy, whose
+	// managedObjects map paths to proxies. successCB is called with the
+	// manager once hydrated, changedCB with (path, proxy, added interface
+	// names, removed interface names) as interfaces come and go, proxy
+	// being null for removed objects. Stop updates with
+	// manager.disconnectSignal("org.freedesktop.DBus.ObjectManager", "mirror").
+	var self = this;
+	var manager = new cloudeebus.ProxyObject(this.wampSession, this, busName, objectPath);
+	var interfaces = {};
+	manager.managedObjects = {};
+	
+	function addInterfaces(path, added) {
+		var proxy = manager.managedObjects[path];
+		if (!proxy)
+			proxy = manager.managedObjects[path] = new cloudeebus.ProxyObject(self.wampSession, self, busName, path);
+		for (var ifName in added)
+			proxy._addInterface({
+				name: ifName,
+				methods: interfaces[ifName] ? interfaces[ifName] : [],
+				properties: added[ifName]
+			});
+		return proxy;
+	}
+	
+	function objectsHandler(id, data) {
+		try {
+			var delta = cloudeebus.decode(data);
+			var path = delta[0];
+			var added = [];
+			for (var ifName in delta[1])
+				added.push(ifName);
+			var proxy = manager.managedObjects[path];
+			if (added.length > 0)
+				proxy = addInterfaces(path, delta[1]);
+			for (var i=0; i < delta[2].length; i++) {
+				if (proxy)
+					proxy._removeInterface(delta[2][i]);
+			}
+			if (proxy) {
+				var remaining = 0;
+				for (var ifName in proxy.interfaceProxies)
+					remaining++;
+				if (remaining == 0) {
+					delete manager.managedObjects[path];
+					proxy = null;
+				}
+			}
+			// interfaces not seen in the snapshot need introspection for their methods
+			var unknown = false;
+			for (var i=0; i < added.length; i++) {
+				if (!interfaces[added[i]])
+					unknown = true;
+			}
+			if (unknown && proxy)
+				proxy._introspect(function() {
+					if (changedCB)
+						changedCB.apply(manager, [path, proxy, added, delta[2]]);
+				}, errorCB);
+			else if (changedCB)
+				changedCB.apply(manager, [path, proxy, added, delta[2]]);
+		}
+		catch (e) {
+			var errorStr = cloudeebus.getError(e);
+			cloudeebus.log("Managed objects handler exception: " + errorStr);
+			if (errorCB)
+				errorCB(errorStr);
+		}
+	}
+	
+	function getManagedObjectsSuccessCB(str) {
+		try {
+			var snapshot = cloudeebus.decode(str);
+			interfaces = snapshot[2];
+			manager.signalIds["org.freedesktop.DBus.ObjectManager#mirror"] = snapshot[0];
+			self.wampSession.subscribe(snapshot[0], objectsHandler);
+			for (var path in snapshot[1])
+				addInterfaces(path, snapshot[1][path]);
+		}
+		catch (e) {
+			var errorStr = cloudeebus.getError(e);
+			cloudeebus.log("Managed objects exception: " + errorStr);
+			if (errorCB)
+				errorCB(errorStr);
+			return;
+		}
+		if (successCB)
+			successCB(manager);
+	}
+	
+	function getManagedObjectsErrorCB(error) {
+		var errorStr = cloudeebus.getError(error);
+		cloudeebus.log("Error getting managed objects of: " + objectPath + " : " + errorStr);
+		if (errorCB)
+			errorCB(errorStr);
+	}
+	
+	// call getManagedObjects with bus type, destination and object manager
+	this.wampSession.call("getManagedObjects", [this.name, busName, objectPath]).then(getManagedObjectsSuccessCB, getManagedObjectsErrorCB);
+	return manager;
+};
+
+
+cloudeebus.BusConnection.prototype.callMethods = function(calls) {
+	// calls: array of [busName, objectPath, ifName, method, args, [signature]]
+	// returns an array of promises, one per call, resolved from a single reply
+	var self = this;
+	var arglists = [];
+	var resolvers = [];
+	var promises = [];
+	
+	for (var i=0; i < calls.length; i++) {
+		var promise = new cloudeebus.Promise();
+		promises.push(promise);
+		resolvers.push(promise.resolver);
+		arglists.push([
+			self.name,
+			calls[i][0],
+			calls[i][1],
+			calls[i][2],
+			calls[i][3],
+			cloudeebus.encode(calls[i][4] ? calls[i][4] : [])
+		]);
+		if (calls[i][5] != undefined)
+			arglists[i].push(calls[i][5]);
+	}
+	
+	if (calls.length > 0)
+		self._sendBatch(arglists, resolvers);
+	
+	return promises;
+};
+
+
+cloudeebus.BusConnection.prototype._sendBatch = function(arglists, resolvers, doneCB) {
+	
+	// settle every promise of the batch even if a callback throws,
+	// then let the caller send its next batch
+	function settleCalls(settleCB) {
+		for (var i=0; i < resolvers.length; i++) {
+			try {
+				settleCB(i);
+			}
+			catch (e) {
+				cloudeebus.log("Method callback exception: " + cloudeebus.getError(e));
+			}
+		}
+		if (doneCB)
+			doneCB();
+	}
+	
+	function sendBatchSuccessCB(replies) {
+		settleCalls(function(i) {
+			if (replies[i][0])
+				cloudeebus.ProxyObject._fulfillCall(resolvers[i], replies[i][1]);
+			else {
+				cloudeebus.log("Error calling method: " + arglists[i][4] + " on object: " + arglists[i][2] + " : " + replies[i][1]);
+				resolvers[i].reject(replies[i][1], true);
+			}
+		});
+	}
+	
+	function sendBatchErrorCB(error) {
+		var errorStr = cloudeebus.getError(error);
+		cloudeebus.log("Error sending batch: " + errorStr);
+		settleCalls(function(i) {
+			resolvers[i].reject(errorStr, true);
+		});
+	}
+	
+	// call dbusSendBatch with a list of dbusSend argument lists
+	this.wampSession.call("dbusSendBatch", arglists).then(sendBatchSuccessCB, sendBatchErrorCB);
+};
+
+
+cloudeebus.BusConnection.prototype._queueCall = function(arglist, resolver) {
+	// queue a dbusSend argument list until the end of the current tick
+	var self = this;
+	this.queuedCalls.push([arglist, resolver]);
+	if (this.flushTimer == null)
+		this.flushTimer = setTimeout(function() {
+			self.flushTimer = null;
+			self._flushCalls();
+		}, 0);
+};
+
+
+cloudeebus.BusConnection.prototype._flushCalls = function() {
+	var self = this;
+	var count = this.queuedCalls.length;
+	if (this.maxOutstanding > 0)
+		count = Math.min(count, this.maxOutstanding - this.outstandingCalls);
+	if (count <= 0)
+		return;
+	
+	var calls = this.queuedCalls.splice(0, count);
+	var arglists = [];
+	var resolvers = [];
+	for (var i=0; i < calls.length; i++) {
+		arglists.push(calls[i][0]);
+		resolvers.push(calls[i][1]);
+	}
+	
+	function batchDoneCB() {
+		self.outstandingCalls -= count;
+		if (self.queuedCalls.length > 0)
+			self._flushCalls();
+	}
+	
+	this.outstandingCalls += count;
+	this._sendBatch(arglists, resolvers, batchDoneCB);
+};
+
+
 cloudeebus.BusConnection.prototype.addService = function(serviceName) {
 	var self = this;
 
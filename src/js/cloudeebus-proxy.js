@@ -24,7 +24,9 @@ cloudeebus.ProxyObject = function(session, busConnection, busName, objectPath) {
 	this.busName = busName; 
 	this.objectPath = objectPath; 
 	this.interfaceProxies = {};
+	this.interfaceMembers = {}; // members the object got from each interface
 	this.childNodeNames = [];
+	this.signalIds = {};
 	return this;
 };
 
@@ -38,85 +40,89 @@ cloudeebus.ProxyObject.prototype._introspect = function(successCB, errorCB) {
 	
 	var self = this; 
 
-	function getAllPropertiesSuccessCB(props) {
-		var ifProxy = self.interfaceProxies[self.propInterfaces[self.propInterfaces.length-1]];
-		for (var prop in props)
-			ifProxy[prop] = self[prop] = props[prop];
-		getAllPropertiesNextInterfaceCB();
-	}
-	
-	function getAllPropertiesNextInterfaceCB() {
-		self.propInterfaces.pop();
-		if (self.propInterfaces.length > 0) 
-			self.callMethod("org.freedesktop.DBus.Properties", 
-				"GetAll", 
-				[self.propInterfaces[self.propInterfaces.length-1]]).then(getAllPropertiesSuccessCB, 
-				errorCB ? errorCB : getAllPropertiesNextInterfaceCB);
-		else {
-			self.propInterfaces = null;
-			if (successCB)
-				successCB(self);
-		}
-	}
-	
 	function introspectSuccessCB(str) {
-		var parser = new DOMParser();
-		var xmlDoc = parser.parseFromString(str, "text/xml");
-		var nodes = xmlDoc.getElementsByTagName("node");
-		// first node is the parent/head node
-		for(var i=1; i < nodes.length; i++)
-			self.childNodeNames.push(nodes[i].getAttribute("name"));
-		var interfaces = xmlDoc.getElementsByTagName("interface");
-		self.propInterfaces = [];
-		var supportDBusProperties = false;
-		for (var i=0; i < interfaces.length; i++) {
-			var ifName = interfaces[i].attributes.getNamedItem("name").value;
-			self.interfaceProxies[ifName] = new cloudeebus.ProxyObject(self.wampSession, self.busConnection, self.busName, self.objectPath);
-			if (ifName == "org.freedesktop.DBus.Properties")
-				supportDBusProperties = true;
-			var hasProperties = false;
-			var ifChild = interfaces[i].firstChild;
-			while (ifChild) {
-				if (ifChild.nodeName == "method") {
-					var nArgs = 0;
-					var signature = "";
-					var metChild = ifChild.firstChild;
-					while (metChild) {
-						if (metChild.nodeName == "arg" &&
-							metChild.attributes.getNamedItem("direction").value == "in") {
-								signature += metChild.attributes.getNamedItem("type").value;
-								nArgs++;
-						}
-						metChild = metChild.nextSibling;
-					}
-					var metName = ifChild.attributes.getNamedItem("name").value;
-					if (!self[metName])
-						self._addMethod(ifName, metName, nArgs, signature);
-					self.interfaceProxies[ifName]._addMethod(ifName, metName, nArgs, signature);
-				}
-				else if (ifChild.nodeName == "property") {
-					if (!hasProperties)
-						self.propInterfaces.push(ifName);
-					hasProperties = true;
-				}
-				ifChild = ifChild.nextSibling;
-			}
+		try {
+			var description = cloudeebus.decode(str);
+			for (var i=0; i < description.children.length; i++)
+				self.childNodeNames.push(description.children[i]);
+			for (var i=0; i < description.interfaces.length; i++)
+				self._addInterface(description.interfaces[i]);
 		}
-		if (supportDBusProperties && self.propInterfaces.length > 0) {
-			self.callMethod("org.freedesktop.DBus.Properties", 
-				"GetAll", 
-				[self.propInterfaces[self.propInterfaces.length-1]]).then(getAllPropertiesSuccessCB, 
-				errorCB ? errorCB : getAllPropertiesNextInterfaceCB);
+		catch (e) {
+			var errorStr = cloudeebus.getError(e);
+			cloudeebus.log("Introspection exception: " + errorStr);
+			if (errorCB)
+				errorCB(errorStr);
+			return;
 		}
-		else {
-			self.propInterfaces = null;
-			if (successCB)
-				successCB(self);
+		if (successCB)
+			successCB(self);
+	}
+
+	function introspectErrorCB(error) {
+		var errorStr = cloudeebus.getError(error);
+		cloudeebus.log("Error introspecting object: " + self.objectPath + " : " + errorStr);
+		if (errorCB)
+			errorCB(errorStr);
+	}
+
+	var arglist = [
+		self.busConnection.name,
+		self.busName,
+		self.objectPath
+	];
+
+	// call dbusIntrospect with bus type, destination and object
+	self.wampSession.call("dbusIntrospect", arglist).then(introspectSuccessCB, introspectErrorCB);
+};
+
+
+cloudeebus.ProxyObject.prototype._addInterface = function(ifDesc) {
+	// ifDesc: {name, methods: array of [name, nArgs, signature], properties}
+	if (this.interfaceProxies[ifDesc.name])
+		this._removeInterface(ifDesc.name);
+	var ifProxy = new cloudeebus.ProxyObject(this.wampSession, this.busConnection, this.busName, this.objectPath);
+	var members = this.interfaceMembers[ifDesc.name] = [];
+	this.interfaceProxies[ifDesc.name] = ifProxy;
+	for (var j=0; j < ifDesc.methods.length; j++) {
+		var metName = ifDesc.methods[j][0];
+		var nArgs = ifDesc.methods[j][1];
+		var signature = ifDesc.methods[j][2];
+		if (!this[metName]) {
+			this._addMethod(ifDesc.name, metName, nArgs, signature);
+			members.push(metName);
 		}
+		ifProxy._addMethod(ifDesc.name, metName, nArgs, signature);
+	}
+	for (var prop in ifDesc.properties) {
+		ifProxy[prop] = this[prop] = ifDesc.properties[prop];
+		members.push(prop);
 	}
+};
+
 
-	// call Introspect on self
-	self.callMethod("org.freedesktop.DBus.Introspectable", "Introspect", []).then(introspectSuccessCB, errorCB);
+cloudeebus.ProxyObject.prototype._removeInterface = function(ifName) {
+	if (!this.interfaceProxies[ifName])
+		return;
+	var members = this.interfaceMembers[ifName];
+	delete this.interfaceProxies[ifName];
+	delete this.interfaceMembers[ifName];
+	// remove the methods and property values the object got from the
+	// interface, other interfaces with the same members provide them again
+	var fields = new cloudeebus.ProxyObject();
+	for (var i=0; i < members.length; i++) {
+		var member = members[i];
+		if (fields.hasOwnProperty(member))
+			continue;
+		delete this[member];
+		for (var other in this.interfaceProxies) {
+			if (this.interfaceProxies[other].hasOwnProperty(member)) {
+				this[member] = this.interfaceProxies[other][member];
+				this.interfaceMembers[other].push(member);
+				break;
+			}
+		}
+	}
 };
 
 
@@ -133,21 +139,14 @@ cloudeebus.ProxyObject.prototype._addMethod = function(ifName, method, nArgs, si
 };
 
 
-cloudeebus.ProxyObject.prototype.callMethod = function(ifName, method, args, signature) {
+cloudeebus.ProxyObject.prototype.callMethod = function(ifName, method, args, signature, timeout) {
+	// timeout in ms, defaults to the proxy callTimeout then to the dbus default
 	
 	var self = this;
 	
 	var promise = new cloudeebus.Promise(function (resolver) {
 		function callMethodSuccessCB(str) {
-			try { // calling dbus hook object function for un-translated types
-				var result = eval(str);
-				resolver.fulfill(result[0], true);
-			}
-			catch (e) {
-				var errorStr = cloudeebus.getError(e);
-				cloudeebus.log("Method callback exception: " + errorStr);
-				resolver.reject(errorStr, true);
-			}
+			cloudeebus.ProxyObject._fulfillCall(resolver, str);
 		}
 
 		function callMethodErrorCB(error) {
@@ -162,10 +161,22 @@ cloudeebus.ProxyObject.prototype.callMethod = function(ifName, method, args, sig
 			self.objectPath,
 			ifName,
 			method,
-			JSON.stringify(args)
+			cloudeebus.encode(args)
 		];
+		if (timeout == undefined)
+			timeout = self.callTimeout;
+		if (signature != undefined || timeout != undefined)
+			arglist.push(signature != undefined ? signature : null);
+		if (timeout != undefined)
+			arglist.push(timeout);
+
+		// batched with the calls of the same tick in autoBatch mode
+		if (self.busConnection.autoBatch) {
+			self.busConnection._queueCall(arglist, resolver);
+			return;
+		}
 
-		// call dbusSend with bus type, destination, object, message and arguments
+		// call dbusSend with bus type, destination, object, message, arguments and signature
 		self.wampSession.call("dbusSend", arglist).then(callMethodSuccessCB, callMethodErrorCB);
 	});
 	
@@ -173,14 +184,44 @@ cloudeebus.ProxyObject.prototype.callMethod = function(ifName, method, args, sig
 };
 
 
-cloudeebus.ProxyObject.prototype.connectToSignal = function(ifName, signal, handlerCB, errorCB) {
+cloudeebus.ProxyObject._fulfillCall = function(resolver, str) {
+	try {
+		var result = cloudeebus.decode(str);
+		resolver.fulfill(result[0], true);
+	}
+	catch (e) {
+		var errorStr = cloudeebus.getError(e);
+		cloudeebus.log("Method callback exception: " + errorStr);
+		resolver.reject(errorStr, true);
+	}
+};
+
+
+cloudeebus.ProxyObject.prototype.connectToSignal = function(ifName, signal, handlerCB, errorCB, options) {
+	// options: {policy: "latest" | "batch", interval: ms} to have signals
+	// coalesced by the server. With "batch", handlerCB is called once per
+	// interval with the array of all the signal argument arrays.
+	// options.match: {argN: string, argNpath: path} to receive only the
+	// signals whose arguments match, filtered by the bus daemon.
+	// options.subtree: true to receive the signal from all the objects under
+	// objectPath, with any sender if busName is "*". handlerCB is then called
+	// with the path of the emitting object before the signal arguments.
+	// With the "latest" policy, it is called for the last signal of each path.
 	
 	var self = this; 
 
 	function signalHandler(id, data) {
 		if (handlerCB) {
-			try { // calling dbus hook object function for un-translated types
-				handlerCB.apply(self, eval(data));
+			try {
+				if (options && options.policy == "batch")
+					handlerCB.apply(self, [cloudeebus.decode(data)]);
+				else if (options && options.policy == "latest" && options.subtree) {
+					var latest = cloudeebus.decode(data);
+					for (var i=0; i<latest.length; i++)
+						handlerCB.apply(self, latest[i]);
+				}
+				else
+					handlerCB.apply(self, cloudeebus.decode(data));
 			}
 			catch (e) {
 				var errorStr = cloudeebus.getError(e);
@@ -193,6 +234,7 @@ cloudeebus.ProxyObject.prototype.connectToSignal = function(ifName, signal, hand
 	
 	function connectToSignalSuccessCB(str) {
 		try {
+			self.signalIds[ifName + "#" + signal] = str;
 			self.wampSession.subscribe(str, signalHandler);
 		}
 		catch (e) {
@@ -214,17 +256,136 @@ cloudeebus.ProxyObject.prototype.connectToSignal = function(ifName, signal, hand
 		ifName,
 		signal
 	];
+	if (options)
+		arglist.push(options);
 
 	// call dbusSend with bus type, destination, object, message and arguments
 	self.wampSession.call("dbusRegister", arglist).then(connectToSignalSuccessCB, connectToSignalErrorCB);
 };
 
 
+cloudeebus.ProxyObject.prototype.onPropertiesChanged = function(ifName, handlerCB, errorCB) {
+	// keeps properties up to date from a server side mirror, handlerCB is
+	// called with (changed, invalidated) for the initial values and each delta
+	
+	var self = this;
+	
+	function updateProperties(changed, invalidated) {
+		var ifProxy = self.interfaceProxies[ifName];
+		for (var prop in changed) {
+			self[prop] = changed[prop];
+			if (ifProxy)
+				ifProxy[prop] = changed[prop];
+		}
+		for (var i=0; i < invalidated.length; i++) {
+			delete self[invalidated[i]];
+			if (ifProxy)
+				delete ifProxy[invalidated[i]];
+		}
+		if (handlerCB)
+			handlerCB.apply(self, [changed, invalidated]);
+	}
+	
+	function propertiesHandler(id, data) {
+		try {
+			var delta = cloudeebus.decode(data);
+			updateProperties(delta[0], delta[1]);
+		}
+		catch (e) {
+			var errorStr = cloudeebus.getError(e);
+			cloudeebus.log("Properties handler exception: " + errorStr);
+			if (errorCB)
+				errorCB(errorStr);
+		}
+	}
+	
+	function propertiesWatchSuccessCB(str) {
+		try {
+			var mirror = cloudeebus.decode(str);
+			self.signalIds[ifName + "#PropertiesChanged#mirror"] = mirror[0];
+			self.wampSession.subscribe(mirror[0], propertiesHandler);
+			updateProperties(mirror[1], []);
+		}
+		catch (e) {
+			var errorStr = cloudeebus.getError(e);
+			cloudeebus.log("Properties watch exception: " + errorStr);
+			if (errorCB)
+				errorCB(errorStr);
+		}
+	}
+	
+	function propertiesWatchErrorCB(error) {
+		var errorStr = cloudeebus.getError(error);
+		cloudeebus.log("Error watching properties of: " + ifName + " on object: " + self.objectPath + " : " + errorStr);
+		if (errorCB)
+			errorCB(errorStr);
+	}
+	
+	var arglist = [
+		self.busConnection.name,
+		self.busName,
+		self.objectPath,
+		ifName
+	];
+	
+	// call propertiesWatch with bus type, destination, object and interface
+	self.wampSession.call("propertiesWatch", arglist).then(propertiesWatchSuccessCB, propertiesWatchErrorCB);
+};
+
+
+cloudeebus.ProxyObject.prototype.getProperty = function(ifName, name) {
+	// reads a property from the server side mirror set up by onPropertiesChanged
+	
+	var self = this;
+	
+	var promise = new cloudeebus.Promise(function (resolver) {
+		function getPropertySuccessCB(str) {
+			cloudeebus.ProxyObject._fulfillCall(resolver, str);
+		}
+		
+		function getPropertyErrorCB(error) {
+			var errorStr = cloudeebus.getError(error);
+			cloudeebus.log("Error getting property: " + name + " on object: " + self.objectPath + " : " + errorStr);
+			resolver.reject(errorStr, true);
+		}
+		
+		var arglist = [
+			self.busConnection.name,
+			self.busName,
+			self.objectPath,
+			ifName,
+			name
+		];
+		
+		// call propertiesGet with bus type, destination, object, interface and property
+		self.wampSession.call("propertiesGet", arglist).then(getPropertySuccessCB, getPropertyErrorCB);
+	});
+	
+	return promise;
+};
+
+
+cloudeebus.ProxyObject.prototype.disconnectPropertiesChanged = function(ifName) {
+	this.disconnectSignal(ifName, "PropertiesChanged#mirror");
+};
+
+
 cloudeebus.ProxyObject.prototype.disconnectSignal = function(ifName, signal) {
+	var id = this.signalIds[ifName + "#" + signal];
+	if (!id)
+		id = this.busConnection.name + "#" + this.busName + "#" + this.objectPath + "#" + ifName + "#" + signal;
+	delete this.signalIds[ifName + "#" + signal];
 	try {
-		this.wampSession.unsubscribe(this.busConnection.name + "#" + this.busName + "#" + this.objectPath + "#" + ifName + "#" + signal);
+		this.wampSession.unsubscribe(id);
 	}
 	catch (e) {
 		cloudeebus.log("Unsubscribe error: " + cloudeebus.getError(e));
 	}
+	
+	function disconnectSignalErrorCB(error) {
+		cloudeebus.log("Error disconnecting signal: " + id + " : " + cloudeebus.getError(error));
+	}
+	
+	// release the server side signal handler
+	this.wampSession.call("dbusUnregister", [id]).then(null, disconnectSignalErrorCB);
 };
@@ -32,6 +32,7 @@ cloudeebus.Service = function(session, busConnection, name) {
 	this.name = name;
 	this.agents = [];
 	this.isCreated = false;
+	this._pendingSignals = null;
 	return this;
 };
 
@@ -91,9 +92,7 @@ cloudeebus.Service.prototype._addMethod = function(ifName, method, agent) {
 		agent.handler.wrapperFunc[method] = function() {
 			var result;
 			var methodId = arguments[0];
-			var callDict = {};
-			// affectation of callDict in eval, otherwise dictionary(='{}') interpreted as block of code by eval
-			eval("callDict = " + arguments[1]);
+			var callDict = cloudeebus.decode(arguments[1]);
 			try {
 				result = funcToCall.apply(agent.handler, callDict.args);
 				service._returnMethod(methodId, callDict.callIndex, true, result);
@@ -242,11 +241,12 @@ cloudeebus.Service.prototype.removeAgent = function(rmAgent) {
 
 
 cloudeebus.Service.prototype._returnMethod = function(methodId, callIndex, success, result, successCB, errorCB) {
+	// results are encoded as a one element args list, errors are messages
 	var arglist = [
 	    methodId,
 	    callIndex,
 	    success,
-	    result
+	    success ? cloudeebus.encode([result === undefined ? null : result]) : result
 	    ];
 
 	this.wampSession.call("returnMethod", arglist).then(successCB, errorCB);
@@ -254,13 +254,54 @@ cloudeebus.Service.prototype._returnMethod = function(methodId, callIndex, succe
 
 
 cloudeebus.Service.prototype._emitSignal = function(objectPath, signalName, args, successCB, errorCB) {
+	var self = this;
 	var arglist = [
 	    objectPath,
 	    signalName,
-	    JSON.stringify(args)
+	    cloudeebus.encode(args)
 	    ];
 
-	this.wampSession.call("emitSignal", arglist).then(successCB, errorCB);
+	// signals emitted in the same tick are sent together with emitSignals
+	if (!self._pendingSignals) {
+		self._pendingSignals = [];
+		setTimeout(function() {
+			self._flushSignals();
+		}, 0);
+	}
+	self._pendingSignals.push([arglist, successCB, errorCB]);
+};
+
+
+cloudeebus.Service.prototype._flushSignals = function() {
+	var signals = this._pendingSignals;
+	var arglists = [];
+	this._pendingSignals = null;
+	
+	for (var i=0; i < signals.length; i++)
+		arglists.push(signals[i][0]);
+	
+	function emitSignalsSuccessCB(replies) {
+		for (var i=0; i < signals.length; i++) {
+			if (replies[i][0]) {
+				if (signals[i][1])
+					signals[i][1](null);
+			}
+			else {
+				cloudeebus.log("Error emitting signal: " + signals[i][0][1] + " on object: " + signals[i][0][0] + " : " + replies[i][1]);
+				if (signals[i][2])
+					signals[i][2](replies[i][1]);
+			}
+		}
+	}
+	
+	function emitSignalsErrorCB(error) {
+		cloudeebus.log("Error emitting signals: " + cloudeebus.getError(error));
+		for (var i=0; i < signals.length; i++)
+			if (signals[i][2])
+				signals[i][2](error);
+	}
+	
+	this.wampSession.call("emitSignals", arglists).then(emitSignalsSuccessCB, emitSignalsErrorCB);
 };
 
 